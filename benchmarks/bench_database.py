@@ -0,0 +1,103 @@
+import random
+import analytics
+import query_cache
+from common import measure, temp_database
+from database import (upsert_watches, insert_watch, query_watches, get_filtered_values, get_watch_statistics,
+                      get_price_statistics, get_facet_counts)
+
+BRANDS = ['Rolex', 'Omega', 'Patek Philippe', 'Audemars Piguet', 'Tudor', 'IWC', 'Richard Mille', 'A Lange & Sohne']
+CONDITIONS = ['New', 'Unworn', 'Very good', 'Good', 'Fair', 'N/A']
+CURRENCIES = ['GBP', 'GBP', 'GBP', 'EUR', 'USD']
+BATCH_SIZE = 10_000
+SINGLE_INSERTS = 1_000
+DUPLICATE_INSERTS = 5_000
+
+
+def synthetic_rows(count, seed=0, start=0):
+    rng = random.Random(seed)
+    for product_id in range(start, start + count):
+        brand = BRANDS[rng.randrange(len(BRANDS))]
+        model = f"{brand} Model {rng.randrange(40)}"
+        ref = f"{rng.randrange(1000, 999999)}{rng.choice(['', 'LN', 'LV', '.001', '-0001'])}"
+        yield (str(product_id), brand, model, ref, round(rng.uniform(500, 250000), 2), rng.choice(CURRENCIES),
+               rng.choice(CONDITIONS), str(rng.randrange(1950, 2025)))
+
+
+def duplicate_rows(size, count, seed=0, start=0):
+    # Relistings of rows from synthetic_rows(size): the same watch under a new product ID,
+    # with the ref spelt differently and the price a little off, so each lands in a block
+    originals = list(synthetic_rows(size))
+    rng = random.Random(seed)
+    for product_id in range(start, start + count):
+        _, brand, model, ref, price, currency, condition, year = originals[rng.randrange(size)]
+        yield (str(product_id), brand, model, rng.choice([ref, ref.lower(), f"Ref. {ref}"]),
+               round(price * rng.uniform(0.99, 1.01), 2), currency, condition, year)
+
+
+def load(conn, rows):
+    new_items = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            new_items += upsert_watches(conn, batch)[0]
+            batch = []
+    if batch:
+        new_items += upsert_watches(conn, batch)[0]
+    return new_items
+
+
+def bench_size(size, repeat=3):
+    results = {}
+    with temp_database() as conn:
+        timing, _ = measure(lambda: load(conn, synthetic_rows(size)), repeat=1)
+        results['upsert_insert'] = dict(timing, rows=size, rows_per_second=size / timing['best'])
+
+        # Same product IDs with new prices: the update path plus the history trigger
+        sample = min(size, BATCH_SIZE)
+        timing, _ = measure(lambda: upsert_watches(conn, list(synthetic_rows(sample, seed=1))), repeat=repeat)
+        results['upsert_update'] = dict(timing, rows=sample, rows_per_second=sample / timing['best'])
+
+        single = [list(row) for row in synthetic_rows(SINGLE_INSERTS, seed=2, start=size)]
+        timing, _ = measure(lambda: [insert_watch(conn, row) for row in single], repeat=1)
+        results['insert_watch'] = dict(timing, rows=SINGLE_INSERTS, rows_per_second=SINGLE_INSERTS / timing['best'])
+
+        # New listings that duplicate existing ones: each write rechecks its block for duplicates
+        relisted = list(duplicate_rows(size, DUPLICATE_INSERTS, seed=3, start=size + SINGLE_INSERTS))
+        timing, _ = measure(lambda: load(conn, relisted), repeat=1)
+        results['upsert_duplicates'] = dict(timing, rows=DUPLICATE_INSERTS, rows_per_second=DUPLICATE_INSERTS / timing['best'])
+
+        queries = {
+            'query_watches_all': lambda: query_watches(conn),
+            'query_watches_brand': lambda: query_watches(conn, brand='Rolex'),
+            'query_watches_brand_model': lambda: query_watches(conn, brand='Rolex', model='Rolex Model 7'),
+            'query_watches_search': lambda: query_watches(conn, search='126'),
+            'get_filtered_values_model': lambda: get_filtered_values(conn, 'model', brand='Rolex'),
+            'get_filtered_values_ref': lambda: get_filtered_values(conn, 'ref'),
+            'get_watch_statistics': lambda: get_watch_statistics(conn),
+            'get_watch_statistics_brand': lambda: get_watch_statistics(conn, brand='Omega'),
+            'get_price_statistics_brand': lambda: get_price_statistics(conn, group_by=('brand',)),
+            'get_facet_counts': lambda: get_facet_counts(conn, brand='Rolex'),
+            # Repeats of an earlier query, answered from query_cache after the first run
+            'cached_price_statistics_brand': lambda: query_cache.get_price_statistics(conn, brand='Omega'),
+            'cached_facet_counts': lambda: query_cache.get_facet_counts(conn, brand='Rolex'),
+            # Reports without their own cache; the bulk read underneath is cached after the first run
+            'analytics_load_watches': lambda: analytics.load_watches.__wrapped__(conn),
+            'analytics_price_index_ref': lambda: analytics.price_index.__wrapped__(conn, by='ref'),
+            'analytics_find_outliers': lambda: analytics.find_outliers.__wrapped__(conn),
+            'analytics_year_price_curve': lambda: analytics.year_price_curve.__wrapped__(conn),
+        }
+        for name, query in queries.items():
+            timing, result = measure(query, repeat=repeat)
+            results[name] = dict(timing, result_size=len(result) if isinstance(result, (list, dict)) else 1)
+    return results
+
+
+def run(sizes=(10_000, 100_000, 1_000_000), repeat=3):
+    results = {}
+    for size in sizes:
+        print(f"Database benchmark at {size:,} rows...")
+        results[str(size)] = bench_size(size, repeat)
+        for name, stats in results[str(size)].items():
+            print(f"  {name}: best {stats['best'] * 1000:.1f}ms")
+    return results
@@ -0,0 +1,63 @@
+import io
+import time
+from contextlib import redirect_stdout
+from common import measure, temp_database
+from fixture_server import FixtureServer
+from database import count_watches
+from http_scraper import HttpFetcher
+from parsing import parse_html
+from scraper import scrape_brand, parse_page, DriverPool
+
+
+def bench_parse(server, repeat=3, iterations=200):
+    catalog = server.catalog
+    listing = catalog.listing('rolex', 1)
+    details = [catalog.detail('rolex', product_id) for product_id in catalog.product_ids('rolex', 1)]
+    results = {}
+    timing, _ = measure(lambda: [parse_html(listing, server.base_url) for _ in range(iterations)], repeat=repeat)
+    results['parse_listing'] = dict(timing, pages=iterations, pages_per_second=iterations / timing['best'])
+    timing, _ = measure(lambda: [parse_html(details[i % len(details)]).graph_nodes() for i in range(iterations)],
+                        repeat=repeat)
+    results['parse_detail'] = dict(timing, pages=iterations, pages_per_second=iterations / timing['best'])
+    return results
+
+
+def scrape(server, workers, pages, use_browser=False):
+    # Fresh database each time so every watch goes down the insert path
+    with temp_database() as conn, redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        if use_browser:
+            driver_pool = DriverPool()
+            try:
+                for page in range(1, pages + 1):
+                    parse_page(f"{server.catalog.brand_url('rolex')}?page={page}", conn, driver_pool)
+            finally:
+                driver_pool.close()
+        else:
+            fetcher = HttpFetcher(pool_size=workers)
+            try:
+                scrape_brand('Rolex', conn, server.catalog.brand_url('rolex'), max_pages=pages, fetcher=fetcher,
+                             workers=workers)
+            finally:
+                fetcher.close()
+        elapsed = time.perf_counter() - start
+        items = count_watches(conn)
+    return {'seconds': elapsed, 'items': items, 'items_per_second': items / elapsed if elapsed > 0 else 0.0}
+
+
+def run(pages=3, per_page=30, latency=0.02, workers=(1, 4, 8), browser=False, repeat=3):
+    results = {}
+    with FixtureServer(pages=pages, per_page=per_page, latency=latency) as server:
+        print(f"Pipeline benchmark against {server.base_url} ({pages} pages x {per_page}, {latency * 1000:.0f}ms latency)...")
+        results.update(bench_parse(server, repeat))
+        for count in workers:
+            runs = [scrape(server, count, pages) for _ in range(repeat)]
+            best = min(runs, key=lambda run: run['seconds'])
+            results[f"scrape_brand_http_workers_{count}"] = dict(best, runs=[run['seconds'] for run in runs])
+        if browser:
+            # Needs Chrome and chromedriver; one run is plenty at browser speeds
+            results['parse_page_selenium'] = scrape(server, 1, pages, use_browser=True)
+    for name, stats in results.items():
+        rate = stats.get('items_per_second') or stats.get('pages_per_second')
+        print(f"  {name}: {rate:.1f}/sec")
+    return results
@@ -0,0 +1,39 @@
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+
+def measure(func, repeat=3):
+    # Runs func `repeat` times; returns the timings plus whatever the last call returned
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return {'best': min(timings), 'median': statistics.median(timings), 'runs': timings}, result
+
+
+@contextmanager
+def temp_database():
+    # setup_database() creates watches.db in the working directory, so run it from a scratch one
+    from database import setup_database
+
+    previous_dir = os.getcwd()
+    work_dir = tempfile.mkdtemp(prefix='watch-bench-')
+    os.chdir(work_dir)
+    conn = setup_database()
+    try:
+        yield conn
+    finally:
+        conn.close()
+        os.chdir(previous_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,129 @@
+import json
+import os
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from string import Template
+from urllib.parse import urlparse, parse_qs
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+DETAIL_PATTERN = re.compile(r'^/([^/]+)/([^/]+)--id(\d+)\.htm$')
+LISTING_PATTERN = re.compile(r'^/([^/]+)/index\.htm$')
+MODELS = ['Submariner', 'Daytona', 'GMT-Master II', 'Datejust', 'Explorer', 'Sea-Dweller']
+CONDITIONS = ['New', 'Unworn', 'Very good', 'Good', 'Fair']
+
+
+def load_template(name):
+    with open(os.path.join(FIXTURE_DIR, name), encoding='utf-8') as f:
+        return Template(f.read())
+
+
+class FixtureCatalog:
+    # Deterministic listing and detail pages built from the templates in fixtures/.
+    # Every brand has `pages` listing pages of `per_page` watches each.
+    def __init__(self, base_url, brands=('rolex',), pages=5, per_page=30):
+        self.base_url = base_url
+        self.brands = list(brands)
+        self.pages = pages
+        self.per_page = per_page
+        self.listing_template = load_template('listing.html')
+        self.card_template = load_template('card.html')
+        self.detail_templates = [load_template('detail_button.html'), load_template('detail_span.html')]
+
+    def brand_url(self, slug):
+        return f"{self.base_url}/{slug}/index.htm"
+
+    def watch(self, slug, product_id):
+        model = MODELS[product_id % len(MODELS)]
+        price = 5000 + (product_id * 37) % 20000
+        return {
+            'slug': slug, 'brand': slug.capitalize(), 'model': model,
+            'model_slug': model.lower().replace(' ', '-'),
+            'product_id': product_id, 'ref': f"{126000 + product_id % 900}LN",
+            'price': price, 'price_text': f"{price:,}",
+            'condition': CONDITIONS[product_id % len(CONDITIONS)],
+            'year': str(1990 + product_id % 34),
+        }
+
+    def product_ids(self, slug, page):
+        brand_offset = self.brands.index(slug) * 1_000_000
+        start = brand_offset + (page - 1) * self.per_page
+        return range(start, start + self.per_page)
+
+    def listing(self, slug, page):
+        if slug not in self.brands or not 1 <= page <= self.pages:
+            return None
+        cards = ''.join(self.card_template.substitute(self.watch(slug, product_id))
+                        for product_id in self.product_ids(slug, page))
+        next_link = f'<a href="/{slug}/index.htm?page={page + 1}" class="paging-next">Next</a>' if page < self.pages else ''
+        return self.listing_template.substitute(base=self.base_url, slug=slug, brand=slug.capitalize(), cards=cards,
+                                                total_count=f"{self.pages * self.per_page:,}", next_link=next_link)
+
+    def detail(self, slug, product_id):
+        if slug not in self.brands:
+            return None
+        watch = self.watch(slug, product_id)
+        graph = {'@context': 'https://schema.org', '@graph': [
+            {'@type': 'BreadcrumbList', 'itemListElement': [
+                {'@type': 'ListItem', 'position': 1, 'item': {'name': 'Home'}},
+                {'@type': 'ListItem', 'position': 2, 'item': {'name': watch['brand']}},
+                {'@type': 'ListItem', 'position': 3, 'item': {'name': f"{watch['brand']} {watch['model']} watches"}},
+            ]},
+            {'@type': 'Product', 'productID': str(product_id), 'brand': watch['brand'], 'sku': watch['ref'],
+             'productionDate': watch['year'],
+             'offers': {'@type': 'Offer', 'price': watch['price'], 'priceCurrency': 'GBP'}},
+        ]}
+        # Alternate between the condition button and the .article-condition span layouts
+        template = self.detail_templates[product_id % len(self.detail_templates)]
+        return template.substitute(watch, json_ld=json.dumps(graph))
+
+    def render(self, path, query):
+        match = LISTING_PATTERN.match(path)
+        if match:
+            return self.listing(match.group(1), int(query.get('page', ['1'])[0]))
+        match = DETAIL_PATTERN.match(path)
+        if match:
+            return self.detail(match.group(1), int(match.group(3)))
+        return None
+
+
+class FixtureServer:
+    # Serves a FixtureCatalog on 127.0.0.1 from a background thread. latency adds a
+    # fixed delay per request to stand in for the network round trip.
+    def __init__(self, brands=('rolex',), pages=5, per_page=30, latency=0.0, port=0):
+        catalog_holder = {}
+        server_latency = latency
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                if server_latency:
+                    time.sleep(server_latency)
+                body = catalog_holder['catalog'].render(parsed.path, parse_qs(parsed.query))
+                if body is None:
+                    self.send_error(404)
+                    return
+                data = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.httpd.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.catalog = catalog_holder['catalog'] = FixtureCatalog(self.base_url, brands, pages, per_page)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='FixtureServer', daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,88 @@
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import time
+import common  # noqa: F401  (puts src/ on sys.path)
+import bench_database
+import bench_pipeline
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(current, baseline_path):
+    # Prints best-time ratios against an earlier results file (>1.00 means slower now)
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    print(f"Compared with {baseline['commit']} ({baseline_path}):")
+    for suite, entries in current['suites'].items():
+        for name, stats, old in iterate_pairs(entries, baseline['suites'].get(suite, {})):
+            new_time = stats.get('best', stats.get('seconds'))
+            old_time = old.get('best', old.get('seconds'))
+            if new_time and old_time:
+                print(f"  {suite}/{name}: {new_time / old_time:.2f}x")
+
+
+def iterate_pairs(entries, old_entries, prefix=''):
+    for name, stats in entries.items():
+        old = old_entries.get(name)
+        if not isinstance(stats, dict) or not isinstance(old, dict):
+            continue
+        if 'best' in stats or 'seconds' in stats:
+            yield prefix + name, stats, old
+        else:
+            yield from iterate_pairs(stats, old, f"{prefix}{name}/")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmarks for the scrape-parse-store pipeline')
+    parser.add_argument('--suite', choices=['all', 'database', 'pipeline'], default='all')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000],
+                        help='synthetic row counts for the database benchmarks')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--pages', type=int, default=3)
+    parser.add_argument('--per-page', type=int, default=30)
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds of simulated latency per request')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--browser', action='store_true', help='also run parse_page through headless Chrome')
+    parser.add_argument('--output', help='results file (default: results/<timestamp>-<commit>.json)')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    args = parser.parse_args()
+
+    commit = git_revision()
+    results = {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'suites': {},
+    }
+    if args.suite in ('all', 'pipeline'):
+        results['suites']['pipeline'] = bench_pipeline.run(args.pages, args.per_page, args.latency, args.workers,
+                                                           args.browser, args.repeat)
+    if args.suite in ('all', 'database'):
+        results['suites']['database'] = bench_database.run(args.sizes, args.repeat)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+import math
+import numpy as np
+from database import build_filters, filter_column, GROUP_BY_COLUMNS
+from query_cache import ResultCache, cached
+
+# Columns loaded for analysis; prices are compared in BASE_CURRENCY (price_base)
+COLUMNS = ('product_id', 'brand', 'model', 'ref', 'ref_key', 'condition', 'year', 'condition_code', 'price_base',
+           'duplicate_of')
+TEXT_COLUMNS = ('product_id', 'brand', 'model', 'ref', 'ref_key', 'condition', 'duplicate_of')
+DEFAULT_FRACTIONS = (0.25, 0.5, 0.75)
+# Reports hold whole column arrays, so keep fewer of them than query_cache does
+CACHE_SIZE = 16
+# Spread below which a group's listings count as identically priced (5%), so a
+# single listing a little off a flat group isn't flagged as an outlier
+MIN_LOG_SPREAD = math.log(1.05)
+# Scales the median absolute deviation to a standard deviation for normal data
+MAD_SCALE = 1.4826
+
+
+reports = ResultCache(CACHE_SIZE, name='reports')
+
+
+@cached(reports)
+def load_watches(conn, **filters):
+    # One bulk read of the filtered watches into {column: array}. Text columns are object
+    # arrays (None where missing); year and price_base are floats with NaN where missing.
+    filter_query, params = build_filters(**filters)
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT {', '.join(COLUMNS)} FROM watches WHERE 1=1" + filter_query, params)
+    rows = cursor.fetchall()
+    values = list(zip(*rows)) if rows else [()] * len(COLUMNS)
+
+    data = {}
+    for column, column_values in zip(COLUMNS, values):
+        if column in TEXT_COLUMNS:
+            data[column] = np.array(column_values, dtype=object)
+        elif column == 'condition_code':
+            data[column] = np.array(column_values, dtype=np.int64)
+        else:
+            data[column] = np.array(column_values, dtype=np.float64)
+    return data
+
+
+def present(keys):
+    if keys.dtype == object:
+        return (keys != None) & (keys != '')
+    return ~np.isnan(keys)
+
+
+def quantiles(values, starts, counts, fraction):
+    # values sorted within each group; linear interpolation like database.percentile
+    position = starts + fraction * (counts - 1)
+    lower = np.floor(position).astype(np.int64)
+    upper = np.minimum(lower + 1, starts + counts - 1)
+    weight = position - lower
+    return values[lower] * (1 - weight) + values[upper] * weight
+
+
+def group_stats(keys, values, fractions=DEFAULT_FRACTIONS):
+    # Per-group count, mean and quantiles in one sort: rows are ordered by (group, value) so
+    # each group is a contiguous run. Rows with a missing key or value are left out.
+    # Returns (labels, counts, means, {fraction: array}, inverse, mask): mask marks the kept
+    # rows and inverse maps each kept row to its group.
+    mask = present(keys) & ~np.isnan(values)
+    labels, inverse = np.unique(keys[mask], return_inverse=True)
+    values = values[mask]
+    order = np.lexsort((values, inverse))
+    sorted_values = values[order]
+    counts = np.bincount(inverse, minlength=len(labels))
+    starts = np.cumsum(counts) - counts
+    sums = np.add.reduceat(sorted_values, starts) if len(sorted_values) else np.zeros(0)
+    stats = {fraction: quantiles(sorted_values, starts, counts, fraction) for fraction in fractions}
+    return labels, counts, sums / np.maximum(counts, 1), stats, inverse, mask
+
+
+def percentile_key(fraction):
+    return f"p{round(fraction * 100):02d}"
+
+
+@cached(reports)
+def price_distribution(conn, bins=20, **filters):
+    # Histogram of BASE_CURRENCY prices on log-spaced bins, plus summary percentiles
+    prices = load_watches(conn, **filters)['price_base']
+    prices = prices[~np.isnan(prices) & (prices > 0)]
+    if not len(prices):
+        return {'edges': np.zeros(0), 'counts': np.zeros(0, dtype=np.int64), 'count': 0}
+
+    edges = np.geomspace(prices.min(), prices.max(), bins + 1) if prices.min() < prices.max() else np.array([prices.min()] * 2)
+    counts, edges = np.histogram(prices, bins=edges)
+    report = {'edges': edges, 'counts': counts, 'count': len(prices), 'mean': float(prices.mean())}
+    for fraction, value in zip((0.05, 0.25, 0.5, 0.75, 0.95), np.quantile(prices, (0.05, 0.25, 0.5, 0.75, 0.95))):
+        report[percentile_key(fraction)] = float(value)
+    report['median'] = report['p50']
+    return report
+
+
+@cached(reports)
+def price_index(conn, by='ref', min_count=1, **filters):
+    # Price level per brand/model/ref/...: {by: labels, count, mean, p25, median, p75},
+    # groups with at least min_count priced listings, most listed first. Refs are indexed by key.
+    if by not in GROUP_BY_COLUMNS:
+        raise ValueError(f"Cannot index prices by {by!r}")
+
+    data = load_watches(conn, **filters)
+    labels, counts, means, stats, _, _ = group_stats(data[filter_column(by)], data['price_base'])
+    keep = counts >= min_count
+    order = np.argsort(-counts[keep], kind='stable')
+    report = {by: labels[keep][order], 'count': counts[keep][order], 'mean': means[keep][order]}
+    for fraction, values in stats.items():
+        report[percentile_key(fraction)] = values[keep][order]
+    report['median'] = report['p50']
+    return report
+
+
+@cached(reports)
+def find_outliers(conn, by='ref', threshold=3.5, min_count=5, **filters):
+    # Listings priced far from their group's median: a robust z-score of the log price
+    # (distance from the group median in scaled median absolute deviations) above
+    # threshold, in groups with at least min_count priced listings. Most extreme first.
+    if by not in GROUP_BY_COLUMNS:
+        raise ValueError(f"Cannot group outliers by {by!r}")
+
+    data = load_watches(conn, **filters)
+    prices = data['price_base']
+    log_prices = np.log(np.where(prices > 0, prices, np.nan))
+    keys = data[filter_column(by)]
+    labels, counts, _, stats, inverse, mask = group_stats(keys, log_prices, (0.5,))
+    medians = stats[0.5]
+
+    deviations = np.abs(log_prices[mask] - medians[inverse])
+    _, _, _, deviation_stats, _, _ = group_stats(inverse.astype(np.float64), deviations, (0.5,))
+    spread = np.maximum(deviation_stats[0.5] * MAD_SCALE, MIN_LOG_SPREAD)
+    scores = deviations / spread[inverse]
+
+    flagged = (scores > threshold) & (counts[inverse] >= min_count)
+    rows = np.flatnonzero(mask)[flagged]
+    order = np.argsort(-scores[flagged], kind='stable')
+    rows = rows[order]
+    group_medians = np.exp(medians[inverse][flagged][order])
+    report = {column: data[column][rows] for column in ('product_id', 'brand', 'model', 'ref', 'year')}
+    report.update({'price_base': prices[rows], 'group_median': group_medians,
+                   'ratio': prices[rows] / group_medians, 'score': scores[flagged][order]})
+    return report
+
+
+@cached(reports)
+def year_price_curve(conn, fractions=DEFAULT_FRACTIONS, **filters):
+    # Price by production year: {year, count, mean, p25, median, p75} per year in order,
+    # plus annual_change, the yearly price change of a log-linear fit across all listings
+    data = load_watches(conn, **filters)
+    years, prices = data['year'], data['price_base']
+    labels, counts, means, stats, _, _ = group_stats(years, prices, sorted(set(fractions) | {0.5}))
+    report = {'year': labels.astype(np.int64), 'count': counts, 'mean': means}
+    for fraction, values in stats.items():
+        report[percentile_key(fraction)] = values
+    report['median'] = report['p50']
+
+    usable = ~np.isnan(years) & (prices > 0)
+    if len(labels) > 1:
+        slope = np.polyfit(years[usable], np.log(prices[usable]), 1)[0]
+        report['annual_change'] = float(np.expm1(slope))
+    else:
+        report['annual_change'] = None
+    return report
+
+
+def to_rows(report):
+    # Column report -> list of dicts, e.g. for a table view; scalar entries are dropped
+    columns = {name: values for name, values in report.items() if isinstance(values, np.ndarray)}
+    count = len(next(iter(columns.values()))) if columns else 0
+    return [{name: values[index].item() if hasattr(values[index], 'item') else values[index]
+             for name, values in columns.items()} for index in range(count)]
+
+
+def to_dataframe(data):
+    # load_watches() or report columns as a pandas DataFrame; pandas is only needed here
+    try:
+        import pandas
+    except ImportError:
+        raise RuntimeError("DataFrames need pandas (pip install pandas)")
+    return pandas.DataFrame({name: values for name, values in data.items() if isinstance(values, np.ndarray)})
@@ -0,0 +1,115 @@
+import sqlite3
+import threading
+import time
+import zlib
+from metrics import metrics
+
+DEFAULT_TTL = 12 * 60 * 60
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+class ResponseCache:
+    # On-disk cache of fetched HTML keyed by URL. Bodies are zlib-compressed; entries
+    # expire after ttl seconds and the least recently used ones are evicted once the
+    # compressed total passes max_bytes. Safe to share between scraper threads.
+    def __init__(self, path='scrape_cache.db', ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS responses (
+            url TEXT PRIMARY KEY,
+            body BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            fetched_at REAL NOT NULL,
+            last_access REAL NOT NULL
+        )
+        ''')
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)")
+        self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, url, ttl=None, since=None):
+        # since (a timestamp) also treats entries fetched before it as missing
+        ttl = self.ttl if ttl is None else ttl
+        with self.lock:
+            row = self.conn.execute("SELECT body, fetched_at FROM responses WHERE url = ?", (url,)).fetchone()
+            if row is None or (ttl is not None and time.time() - row[1] > ttl) or (since is not None and row[1] < since):
+                self.misses += 1
+                metrics.increment('cache_lookups', result='miss')
+                return None
+            self.conn.execute("UPDATE responses SET last_access = ? WHERE url = ?", (time.time(), url))
+            self.conn.commit()
+            self.hits += 1
+        metrics.increment('cache_lookups', result='hit')
+        return zlib.decompress(row[0]).decode('utf-8')
+
+    def put(self, url, text):
+        body = zlib.compress(text.encode('utf-8'), 6)
+        now = time.time()
+        with self.lock:
+            previous = self.conn.execute("SELECT size FROM responses WHERE url = ?", (url,)).fetchone()
+            self.conn.execute('''
+            INSERT INTO responses (url, body, size, fetched_at, last_access) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(url) DO UPDATE SET body = excluded.body, size = excluded.size,
+                fetched_at = excluded.fetched_at, last_access = excluded.last_access
+            ''', (url, body, len(body), now, now))
+            self.total_bytes += len(body) - (previous[0] if previous else 0)
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes:
+            rows = self.conn.execute("SELECT url, size FROM responses ORDER BY last_access LIMIT 100").fetchall()
+            if not rows:
+                self.total_bytes = 0
+                break
+            for url, size in rows:
+                self.conn.execute("DELETE FROM responses WHERE url = ?", (url,))
+                self.total_bytes -= size
+                if self.total_bytes <= self.max_bytes:
+                    break
+
+    def purge_expired(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM responses WHERE fetched_at < ?", (time.time() - self.ttl,))
+            self.conn.commit()
+            self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def items(self):
+        # Every cached (url, html) pair regardless of age, e.g. for FixtureFetcher(dict(cache.items()))
+        with self.lock:
+            rows = self.conn.execute("SELECT url, body FROM responses").fetchall()
+        for url, body in rows:
+            yield url, zlib.decompress(body).decode('utf-8')
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class CachingFetcher:
+    # Serves pages from a ResponseCache and only goes to the wrapped fetcher on a miss.
+    # Listing pages (URLs with ?page=) can be given a shorter TTL than detail pages, and
+    # pages fetched before since are never served.
+    def __init__(self, fetcher, cache, listing_ttl=None, since=None):
+        self.fetcher = fetcher
+        self.cache = cache
+        self.listing_ttl = listing_ttl
+        self.since = since
+
+    def fetch(self, url):
+        ttl = self.listing_ttl if self.listing_ttl is not None and '?page=' in url else None
+        text = self.cache.get(url, ttl=ttl, since=self.since)
+        if text is None:
+            text = self.fetcher.fetch(url)
+            self.cache.put(url, text)
+        return text
+
+    def close(self):
+        self.fetcher.close()
@@ -0,0 +1,259 @@
+import argparse
+import json
+import os
+import random
+import signal
+import sys
+import threading
+import time
+from database import setup_database, get_brands, save_brand, get_crawl_run_start, DEFAULT_DB_PATH
+from metrics import metrics
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+DEFAULT_PAGE_BUDGET = 5
+LOCK_PATH = 'scrape.lock'
+
+
+class ScrapeInProgress(RuntimeError):
+    pass
+
+
+def initial_scrape(conn, workers=4, rate_limit=4.0, incremental=False, progress=None, cancel_event=None,
+                   cache_path='scrape_cache.db', metrics_path='scrape_metrics.prom', brands=None,
+                   max_pages=DEFAULT_PAGE_BUDGET, lock_path=LOCK_PATH):
+    # brands is a list of names from the brands table (default: every enabled brand). max_pages
+    # is the page budget for brands without their own; None follows pagination to the end.
+    # Every scrape (GUI, manual or daemon) holds the RunLock at lock_path, so two never resume
+    # the same crawl run at once; pass None when the caller already holds it. Raises
+    # ScrapeInProgress when another scrape holds the lock.
+    lock = RunLock(lock_path) if lock_path else None
+    if lock is not None and not lock.acquire():
+        raise ScrapeInProgress(f"Another scrape holds {lock_path}")
+    try:
+        return run_crawl(conn, workers, rate_limit, incremental, progress, cancel_event, cache_path, metrics_path,
+                         brands, max_pages)
+    finally:
+        if lock is not None:
+            lock.release()
+
+
+def run_crawl(conn, workers, rate_limit, incremental, progress, cancel_event, cache_path, metrics_path, brands,
+              max_pages):
+    # The scraping modules pull in selenium and requests, so they load on the first scrape
+    # rather than when the GUI starts.
+    from scraper import DriverPool, SeleniumFetcher
+    from crawl import crawl
+    from http_scraper import HttpFetcher, HostRateLimiter, RateLimitedFetcher
+    from cache import ResponseCache, CachingFetcher
+
+    metrics.reset()
+    catalog = get_brands(conn)
+    if brands is not None:
+        catalog = {brand: catalog[brand] for brand in brands}
+
+    # Only requests that reach the site wait for the rate limiter, so cache hits are served at once.
+    # Pages are only reused within one crawl run, for retries and resumed runs: an earlier run's
+    # detail page would hide a price change. Listings are reused only briefly, so new listings show up.
+    cache = ResponseCache(cache_path) if cache_path else None
+    since = get_crawl_run_start(conn) or time.time()
+    fetcher = HttpFetcher(pool_size=workers)
+    driver_pool = DriverPool(size=workers)
+    fallback_fetcher = SeleniumFetcher(driver_pool)
+    if rate_limit:
+        limiter = HostRateLimiter(rate_limit)
+        fetcher = RateLimitedFetcher(fetcher, limiter)
+        fallback_fetcher = RateLimitedFetcher(fallback_fetcher, limiter)
+    if cache is not None:
+        fetcher = CachingFetcher(fetcher, cache, listing_ttl=15 * 60, since=since)
+    try:
+        # Progress is checkpointed in crawl_jobs; an interrupted run resumes on the next call
+        return crawl(conn, {brand: url for brand, (url, _) in catalog.items()}, fetcher, fallback_fetcher,
+                     max_pages=max_pages, page_budgets={brand: budget for brand, (_, budget) in catalog.items()},
+                     workers=workers, incremental=incremental, progress=progress,
+                     cancel_event=cancel_event)
+    finally:
+        fetcher.close()
+        driver_pool.close()
+        if cache is not None:
+            print(f"Cache hits: {cache.hits}, misses: {cache.misses}")
+            cache.close()
+        if metrics_path:
+            # scrape_metrics.prom for a Prometheus textfile collector, or a .jsonl path to keep one snapshot per run
+            metrics.export(metrics_path)
+
+
+class RunLock:
+    # Exclusive, non-blocking lock on a file so two scrapes (e.g. the daemon and a manual
+    # run) never write at the same time. The OS drops it if the process dies.
+    def __init__(self, path=LOCK_PATH):
+        self.path = path
+        self.file = None
+
+    def acquire(self):
+        self.file = open(self.path, 'a+')
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                self.file.seek(0)
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            self.file.close()
+            self.file = None
+            return False
+        self.file.seek(0)
+        self.file.truncate()
+        self.file.write(str(os.getpid()))
+        self.file.flush()
+        return True
+
+    def release(self):
+        if self.file is None:
+            return
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.file.close()
+        self.file = None
+
+
+def load_brand_file(conn, path):
+    # JSON object of brand name -> listing URL, or -> {"url": ..., "max_pages": ..., "enabled": ...}
+    with open(path, encoding='utf-8') as f:
+        brands = json.load(f)
+    for name, entry in brands.items():
+        if isinstance(entry, str):
+            entry = {'url': entry}
+        save_brand(conn, name, entry['url'], entry.get('max_pages'), entry.get('enabled', True))
+    print(f"Loaded {len(brands)} brands from {path}")
+
+
+def run_once(args, brands, cancel_event):
+    lock = RunLock(args.lock)
+    if not lock.acquire():
+        print(f"Another scrape holds {args.lock}, skipping this run")
+        return None
+
+    conn = setup_database(args.db)
+    try:
+        # Re-read every run so the daemon picks up catalog changes
+        if args.brands_file:
+            load_brand_file(conn, args.brands_file)
+        catalog = get_brands(conn)
+        unknown = [brand for brand in brands or [] if brand not in catalog]
+        if unknown:
+            print(f"Unknown or disabled brands: {', '.join(unknown)} (known: {', '.join(catalog)})")
+            return None
+
+        results = initial_scrape(conn, workers=args.workers, rate_limit=args.rate_limit, incremental=args.incremental,
+                                 cancel_event=cancel_event, cache_path=args.cache, metrics_path=args.metrics,
+                                 brands=brands, max_pages=args.pages or None, lock_path=None)
+        for brand, (new_items, updated_items, total_items) in results.items():
+            print(f"{brand}: {new_items} new, {updated_items} updated, {total_items} total")
+        return results
+    finally:
+        conn.close()
+        lock.release()
+
+
+def run_dump(args):
+    from export import export_database, import_database
+
+    lock = RunLock(args.lock)
+    if args.import_dir and not lock.acquire():
+        print(f"A scrape holds {args.lock}; import once it has finished")
+        return 1
+
+    conn = setup_database(args.db)
+    try:
+        if args.export:
+            export_database(conn, args.export, args.format)
+        else:
+            import_database(conn, args.import_dir)
+        return 0
+    finally:
+        conn.close()
+        lock.release()
+
+
+def run_daemon(args, brands, cancel_event):
+    # Runs are scheduled every interval seconds from the previous start, shifted by up to
+    # jitter seconds. A run that overruns its slot makes the scheduler skip the missed
+    # slots rather than start runs back to back.
+    next_run = time.monotonic() + random.uniform(0, args.jitter)
+    while not cancel_event.is_set():
+        delay = next_run - time.monotonic()
+        if delay > 0:
+            print(f"Next scrape in {delay:.0f}s")
+            if cancel_event.wait(delay):
+                break
+
+        started = time.monotonic()
+        try:
+            run_once(args, brands, cancel_event)
+        except Exception as e:
+            print(f"Scheduled scrape failed: {str(e)}")
+
+        next_run = started + args.interval
+        skipped = 0
+        while next_run < time.monotonic():
+            next_run += args.interval
+            skipped += 1
+        if skipped:
+            print(f"Scrape overran its interval, skipped {skipped} scheduled run(s)")
+        next_run += random.uniform(0, args.jitter)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Scrape Chrono24 listings into watches.db without the GUI')
+    parser.add_argument('--db', default=DEFAULT_DB_PATH, help='database file (default: $WATCH_DB_PATH or watches.db)')
+    parser.add_argument('--brand', action='append', dest='brands',
+                        help='brand from the brands table to scrape (repeatable, default: all enabled)')
+    parser.add_argument('--brands-file', help='JSON brand catalog to load into the brands table before scraping')
+    parser.add_argument('--pages', type=int, default=DEFAULT_PAGE_BUDGET,
+                        help='page budget for brands without their own max_pages (0 for every page)')
+    parser.add_argument('--workers', type=int, default=4, help='concurrent detail page fetches')
+    parser.add_argument('--rate-limit', type=float, default=4.0, help='requests per second per host (0 for none)')
+    parser.add_argument('--incremental', action='store_true', help='only open new or re-priced listings')
+    parser.add_argument('--cache', default='scrape_cache.db', help='response cache path ("" to disable)')
+    parser.add_argument('--metrics', default='scrape_metrics.prom', help='metrics export path ("" to disable)')
+    parser.add_argument('--lock', default=LOCK_PATH, help='lock file that prevents overlapping scrapes')
+    parser.add_argument('--daemon', action='store_true', help='keep running and refresh on a schedule')
+    parser.add_argument('--interval', type=float, default=6 * 60 * 60, help='seconds between scheduled runs')
+    parser.add_argument('--jitter', type=float, default=10 * 60, help='random delay of up to this many seconds per run')
+    parser.add_argument('--export', metavar='DIR', help='dump watches and their history to DIR instead of scraping')
+    parser.add_argument('--import', metavar='DIR', dest='import_dir',
+                        help='load a dump written by --export instead of scraping')
+    parser.add_argument('--format', choices=['csv', 'jsonl', 'parquet'], default='csv', help='dump format for --export')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    brands = args.brands
+    if args.export or args.import_dir:
+        return run_dump(args)
+
+    # Ctrl+C / SIGTERM stop after the current listing; the crawl resumes from its checkpoint next time
+    cancel_event = threading.Event()
+    def stop(signum, frame):
+        print("Stopping after the current listing...")
+        cancel_event.set()
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    if args.daemon:
+        run_daemon(args, brands, cancel_event)
+        return 0
+    return 0 if run_once(args, brands, cancel_event) is not None else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,234 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from database import (upsert_watches, save_listing_cards, start_crawl_run, finish_crawl_run, add_crawl_jobs,
+                      get_crawl_jobs, get_next_crawl_attempt, complete_crawl_jobs, fail_crawl_job)
+from parsing import condition_stats
+from metrics import metrics
+from http_scraper import fetch_parsed, changed_listing_links, scrape_detail, HostRateLimiter, RateLimitedFetcher
+
+MAX_ATTEMPTS = 3
+BACKOFF_SECONDS = 5.0
+
+
+class Crawler:
+    # Drives a multi-brand crawl from the crawl_jobs frontier so an interrupted run
+    # resumes where it stopped. Only the calling thread touches conn; the executor
+    # threads fetch and parse.
+    def __init__(self, conn, fetcher, fallback_fetcher=None, workers=1, rate_limit=None, incremental=False,
+                 progress=None, cancel_event=None, max_attempts=MAX_ATTEMPTS, backoff=BACKOFF_SECONDS):
+        self.conn = conn
+        self.fetcher = fetcher
+        self.fallback_fetcher = fallback_fetcher
+        self.workers = workers
+        self.incremental = incremental
+        self.progress = progress
+        self.cancel_event = cancel_event
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.executor = None
+        self.run_id = None
+        self.brand_urls = {}
+        self.page_budgets = {}
+        self.page_counts = {}
+        self.page_sizes = {}
+        self.cards = {}
+
+        # rate_limit wraps the fetchers as given; a caching fetcher should wrap a rate limited one instead
+        if rate_limit:
+            limiter = HostRateLimiter(rate_limit)
+            self.fetcher = RateLimitedFetcher(self.fetcher, limiter)
+            if self.fallback_fetcher is not None:
+                self.fallback_fetcher = RateLimitedFetcher(self.fallback_fetcher, limiter)
+
+    def cancelled(self):
+        return self.cancel_event is not None and self.cancel_event.is_set()
+
+    def run(self, brands, max_pages=1, page_budgets=None):
+        # brands maps brand name -> listing URL. Each brand starts from page 1 and the
+        # next listing page is queued only while the listing says there is one, up to
+        # the brand's page budget (page_budgets, else max_pages; None for no limit).
+        # Returns {brand: (new, updated, total)}.
+        self.brand_urls = dict(brands)
+        self.page_budgets = {brand: (page_budgets or {}).get(brand) or max_pages for brand in brands}
+        self.run_id, resumed = start_crawl_run(self.conn)
+        print(f"{'Resuming' if resumed else 'Starting'} crawl run {self.run_id}")
+        add_crawl_jobs(self.conn, self.run_id, [(self.listing_url(brand, 1), 'listing', brand, 1) for brand in brands])
+        results = {brand: (0, 0, 0) for brand in brands}
+
+        if self.workers > 1:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='crawl')
+        try:
+            for brand_index, brand in enumerate(brands, start=1):
+                if self.cancelled():
+                    break
+                print(f"Scraping {brand}...")
+                self.report({'stage': 'brand_start', 'brand': brand, 'brand_index': brand_index, 'brand_count': len(brands)})
+                results[brand] = self.crawl_brand(brand)
+                new_items, updated_items, total_items = results[brand]
+                print(f"Completed {brand}. Added {new_items} new items, updated {updated_items} items, out of {total_items} total items processed")
+                self.report({'stage': 'brand_done', 'brand': brand, 'brand_index': brand_index, 'brand_count': len(brands),
+                             'new': new_items, 'updated': updated_items, 'items': total_items})
+
+            self.retry_failed(results)
+        finally:
+            print(f"Condition sources:\n{condition_stats.summary()}")
+            print(f"Scraper metrics:\n{metrics.summary()}")
+            if self.executor is not None:
+                self.executor.shutdown(cancel_futures=True)
+                self.executor = None
+
+        if not self.cancelled() and get_next_crawl_attempt(self.conn, self.run_id) is None:
+            finish_crawl_run(self.conn, self.run_id)
+            print(f"Crawl run {self.run_id} finished")
+        return results
+
+    def listing_url(self, brand, page):
+        return f"{self.brand_urls[brand]}?page={page}"
+
+    def page_limit(self, brand):
+        # The smaller of the page budget and the page count the listing reported, if either is known
+        limits = [limit for limit in (self.page_budgets.get(brand), self.page_counts.get(brand)) if limit]
+        return min(limits) if limits else None
+
+    def crawl_brand(self, brand):
+        start_time = time.monotonic()
+        total_new_items = 0
+        total_updated_items = 0
+        total_items = 0
+
+        page = 0
+        while True:
+            if self.cancelled():
+                print(f"Scrape of {brand} cancelled")
+                break
+
+            # Listing pages are discovered as the crawl goes, so re-read the frontier each time
+            pages = [job[3] for job in get_crawl_jobs(self.conn, self.run_id, brand=brand, due_only=False) if job[3] > page]
+            if not pages:
+                break
+            page = min(pages)
+
+            with metrics.timer('page'):
+                new_items, updated_items, items, links = self.crawl_page(brand, page)
+            total_new_items += new_items
+            total_updated_items += updated_items
+            total_items += items
+            print(f"Page {page} complete. New: {new_items}, Updated: {updated_items}, Total: {items}")
+
+            elapsed = time.monotonic() - start_time
+            self.report({
+                'stage': 'page', 'brand': brand, 'page': page, 'max_pages': self.page_limit(brand),
+                'new': new_items, 'updated': updated_items, 'items': items,
+                'total_new': total_new_items, 'total_updated': total_updated_items, 'total_items': total_items,
+                'items_per_second': total_items / elapsed if elapsed > 0 else 0.0,
+            })
+
+            if self.incremental and links == 0:  # None when the listing was processed by an earlier run
+                print(f"No new or changed listings on page {page}, stopping")
+                remaining = get_crawl_jobs(self.conn, self.run_id, brand=brand, kind='listing', due_only=False)
+                complete_crawl_jobs(self.conn, self.run_id, [job[0] for job in remaining if job[3] > page], status='skipped')
+                break
+
+        return total_new_items, total_updated_items, total_items
+
+    def crawl_page(self, brand, page):
+        # Processes the page's listing job (if still pending) and then its due detail jobs.
+        # Returns (new, updated, total, links) where links is how many detail pages the
+        # listing queued, or None if the listing was not fetched this time.
+        links = None
+        for url, _, _, _, _ in get_crawl_jobs(self.conn, self.run_id, brand=brand, page=page, kind='listing'):
+            print(f"Processing page: {url}")
+            try:
+                listing = fetch_parsed(url, self.fetcher, self.fallback_fetcher, lambda parsed: parsed.article_links)
+                links = listing.article_links
+                self.cards.update((card['href'], card) for card in listing.article_cards)
+                if self.incremental:
+                    links = changed_listing_links(self.conn, listing)
+                    print(f"Skipping {len(listing.article_links) - len(links)} unchanged listings")
+                add_crawl_jobs(self.conn, self.run_id, [(href, 'detail', brand, page) for href in links])
+                if not (self.incremental and not links) and self.has_next_page(brand, page, listing):
+                    add_crawl_jobs(self.conn, self.run_id, [(self.listing_url(brand, page + 1), 'listing', brand, page + 1)])
+                complete_crawl_jobs(self.conn, self.run_id, [url])
+            except Exception as e:
+                print(f"Error processing {url}: {str(e)}")
+                metrics.error('listing', e)
+                fail_crawl_job(self.conn, self.run_id, url, e, self.max_attempts, self.backoff)
+
+        jobs = get_crawl_jobs(self.conn, self.run_id, brand=brand, page=page, kind='detail')
+        hrefs = [job[0] for job in jobs]
+        if self.executor is not None:
+            results = zip(hrefs, self.executor.map(self.try_scrape_detail, hrefs))
+        else:
+            results = ((href, self.try_scrape_detail(href)) for href in hrefs)
+
+        rows = []
+        done = []
+        for href, (watch_data, error) in results:
+            if self.cancelled():
+                break
+            print(f"Processing link: {href}")
+            if error is None and watch_data is None:
+                error = "Could not extract watch data from JSON-LD"
+            if error is not None:
+                print(f"Error processing {href}: {error}")
+                fail_crawl_job(self.conn, self.run_id, href, error, self.max_attempts, self.backoff)
+                continue
+            rows.append(watch_data)
+            done.append(href)
+
+        new_items, updated_items = upsert_watches(self.conn, rows)
+        # Cards of listings fetched by an earlier process aren't known; those get re-checked next time
+        save_listing_cards(self.conn, [self.cards[href] for href in done if href in self.cards])
+        complete_crawl_jobs(self.conn, self.run_id, done)
+        return new_items, updated_items, new_items + updated_items, None if links is None else len(links)
+
+    def has_next_page(self, brand, page, listing):
+        if brand not in self.brand_urls:  # left over from a resumed run that had other brands
+            return False
+        if page == 1 and listing.article_links:
+            self.page_sizes[brand] = len(listing.article_links)
+        page_count = listing.page_count(self.page_sizes.get(brand))
+        if page_count is not None:
+            self.page_counts[brand] = page_count
+        budget = self.page_budgets.get(brand)
+        if budget and page >= budget:
+            return False
+        return listing.has_next_page(page, self.page_sizes.get(brand))
+
+    def try_scrape_detail(self, href):
+        if self.cancelled():
+            return None, "cancelled"
+        try:
+            return scrape_detail(href, self.fetcher, self.fallback_fetcher), None
+        except Exception as e:
+            metrics.error('detail', e)
+            return None, str(e)
+
+    def retry_failed(self, results):
+        # Jobs that failed but still have attempts left are retried once their backoff expires
+        while not self.cancelled():
+            next_attempt = get_next_crawl_attempt(self.conn, self.run_id)
+            if next_attempt is None:
+                return
+            delay = next_attempt - time.time()
+            if delay > 0:
+                print(f"Retrying failed jobs in {delay:.0f}s")
+                if self.cancel_event is not None:
+                    self.cancel_event.wait(delay)
+                else:
+                    time.sleep(delay)
+                continue
+
+            due = get_crawl_jobs(self.conn, self.run_id)
+            for brand, page in sorted({(job[2], job[3]) for job in due}):
+                new_items, updated_items, items, _ = self.crawl_page(brand, page)
+                previous = results.get(brand, (0, 0, 0))
+                results[brand] = (previous[0] + new_items, previous[1] + updated_items, previous[2] + items)
+
+    def report(self, event):
+        if self.progress is not None:
+            self.progress(event)
+
+
+def crawl(conn, brands, fetcher, fallback_fetcher=None, max_pages=1, page_budgets=None, **options):
+    return Crawler(conn, fetcher, fallback_fetcher, **options).run(brands, max_pages, page_budgets)
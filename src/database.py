@@ -1,6 +1,19 @@
+import os
+import re
+from bisect import bisect_left, bisect_right
+from itertools import groupby
 import sqlite3
+import threading
+import time
+import queue
+from concurrent.futures import Future
+from contextlib import contextmanager
+from urllib.request import pathname2url
+from metrics import metrics
 
 def format_price(price):
+    if price is None:
+        return 'N/A'
     try:
         # Try to convert the price to float and format it
         return f"{float(price):,.2f}"
@@ -8,9 +21,464 @@ def format_price(price):
         # If conversion fails, return the original string
         return str(price)
 
-def setup_database():
-    conn = sqlite3.connect('watches.db')
+UPSERT_CHUNK_SIZE = 500
+# WATCH_DB_PATH points the GUI and the command line at another database file
+DEFAULT_DB_PATH = os.environ.get('WATCH_DB_PATH', 'watches.db')
+READ_POOL_SIZE = 4
+# Prepared statements kept per connection; filter queries come in many shapes
+STATEMENT_CACHE_SIZE = 256
+
+BASE_CURRENCY = 'GBP'
+# Starting rates (units of BASE_CURRENCY per unit); keep them current with set_currency_rate
+DEFAULT_CURRENCY_RATES = {
+    'GBP': 1.0,
+    'EUR': 0.85,
+    'USD': 0.79,
+    'CHF': 0.89,
+    'HKD': 0.10,
+    'SGD': 0.59,
+    'AUD': 0.52,
+    'CAD': 0.58,
+    'JPY': 0.0053,
+}
+# Stable codes for the condition labels Chrono24 and schema.org use; 0 is unknown
+CONDITION_CODES = {
+    'New': 1,
+    'Unworn': 2,
+    'Very good': 3,
+    'Good': 4,
+    'Fair': 5,
+    'Poor': 6,
+    'Incomplete': 7,
+    'Used': 8,
+    'Refurbished': 9,
+    'Damaged': 10,
+}
+# Longest label first, so "Very good (...)" is not read as "Good"
+CONDITION_PREFIXES = sorted(((label.lower(), code) for label, code in CONDITION_CODES.items()), key=lambda item: -len(item[0]))
+YEAR_PATTERN = re.compile(r'\b(1[89]\d\d|20\d\d)\b')
+PRICE_TEXT_PATTERN = re.compile(r'\d[\d,]*(?:\.\d+)?')
+# "Ref. 5711/1A-010" and "5711 1a 010" share the key 57111A010
+REF_PREFIX_PATTERN = re.compile(r'^\s*(?:ref(?:erence)?|no)[\s.:#]+', re.IGNORECASE)
+REF_SEPARATOR_PATTERN = re.compile(r'[\W_]+')
+MISSING_REFS = {'', 'NA', 'NONE', 'UNKNOWN'}
+# Listings of the same brand, ref and year priced within this fraction of each other are likely duplicates
+DUPLICATE_PRICE_TOLERANCE = 0.03
+
+WATCHES_SCHEMA = '''(
+    product_id TEXT PRIMARY KEY,
+    brand TEXT,
+    model TEXT,
+    ref TEXT,
+    price REAL,
+    currency TEXT,
+    condition TEXT,
+    year INTEGER,
+    condition_code INTEGER NOT NULL DEFAULT 0,
+    price_base REAL,
+    ref_key TEXT,
+    duplicate_of TEXT
+)'''
+
+def parse_price(price):
+    # 12345, "12345.0" or "£12,345" -> float; anything else (e.g. "Price on request") -> None
+    if isinstance(price, (int, float)):
+        return float(price)
+    match = PRICE_TEXT_PATTERN.search(str(price or ''))
+    return float(match.group().replace(',', '')) if match else None
+
+def parse_year(year):
+    # 2020, "2020" or "approx. 1990" -> int; "N/A" / "Unknown" -> None
+    if isinstance(year, int):
+        return year
+    match = YEAR_PATTERN.search(str(year or ''))
+    return int(match.group()) if match else None
+
+def condition_code(condition):
+    text = str(condition or '').strip().lower()
+    for prefix, code in CONDITION_PREFIXES:
+        if text.startswith(prefix):
+            return code
+    return 0
+
+def normalize_ref(ref):
+    # Matching key for a reference: prefix, separators and case removed; None if missing
+    if ref is None:
+        return None
+    key = REF_SEPARATOR_PATTERN.sub('', REF_PREFIX_PATTERN.sub('', str(ref))).upper()
+    return key if key not in MISSING_REFS else None
+
+def normalize_watch(watch_data, rates):
+    # Scraped [product_id, brand, model, ref, price, currency, condition, year] -> the stored row,
+    # with a REAL price, INTEGER year, condition code, the price in BASE_CURRENCY and the ref key
+    product_id, brand, model, ref, price, currency, condition, year = watch_data
+    price = parse_price(price)
+    rate = rates.get(currency)
+    price_base = price * rate if price is not None and rate is not None else None
+    return (product_id, brand, model, ref, price, currency, condition, parse_year(year), condition_code(condition),
+            price_base, normalize_ref(ref))
+
+def configure_connection(conn, read_only=False):
+    cursor = conn.cursor()
+    if read_only:
+        # WAL is a property of the file, set by the write connections
+        cursor.execute("PRAGMA query_only=ON")
+    else:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-20000")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    # Lets INSERT OR REPLACE fire the delete triggers that keep watches_fts in sync
+    cursor.execute("PRAGMA recursive_triggers=ON")
+
+def open_connection(db_path, read_only=False):
+    # Read-only connections may be handed between threads (one user at a time, see ConnectionManager)
+    if read_only:
+        conn = sqlite3.connect(f"file:{pathname2url(os.path.abspath(db_path))}?mode=ro", uri=True, check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE)
+    else:
+        conn = sqlite3.connect(db_path, cached_statements=STATEMENT_CACHE_SIZE)
+    configure_connection(conn, read_only)
+    return conn
+
+OBSERVATION_CHANGED = '''
+    NOT EXISTS (
+        SELECT 1 FROM (
+            SELECT price, currency, condition FROM watch_observations
+            WHERE product_id = NEW.product_id ORDER BY scraped_at DESC LIMIT 1
+        ) AS latest
+        WHERE latest.price IS NEW.price AND latest.currency IS NEW.currency AND latest.condition IS NEW.condition
+    )
+'''
+
+# A trigger runs under the conflict handling of the statement that fired it, so an upsert
+# would ignore OR REPLACE here; two changes within a millisecond keep the later one
+OBSERVATION_INSERT = '''
+    INSERT INTO watch_observations (product_id, scraped_at, price, currency, condition)
+    VALUES (NEW.product_id, strftime('%Y-%m-%dT%H:%M:%f', 'now'), NEW.price, NEW.currency, NEW.condition)
+    ON CONFLICT(product_id, scraped_at) DO UPDATE SET
+        price = excluded.price, currency = excluded.currency, condition = excluded.condition;
+'''
+
+def setup_history(cursor):
+    # Append-only price/condition history. A row is only written when a watch's
+    # price, currency or condition differs from its latest observation.
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='watch_observations'")
+    if cursor.fetchone() is not None:
+        return False
+
+    cursor.execute('''
+    CREATE TABLE watch_observations (
+        product_id TEXT NOT NULL,
+        scraped_at TEXT NOT NULL,
+        price REAL,
+        currency TEXT,
+        condition TEXT,
+        PRIMARY KEY (product_id, scraped_at)
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute("CREATE INDEX idx_watch_observations_scraped_at ON watch_observations(scraped_at)")
+    cursor.execute('''
+    CREATE VIEW latest_watch_observations AS
+    SELECT o.* FROM watch_observations o
+    WHERE o.scraped_at = (SELECT MAX(scraped_at) FROM watch_observations WHERE product_id = o.product_id)
+    ''')
+    return True
+
+def setup_history_triggers(cursor):
+    # Triggers are dropped along with the watches table, so these are (re)created after any rebuild,
+    # and always recreated so an older definition is replaced
+    for trigger in ('watches_observe_insert', 'watches_observe_update'):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    cursor.execute(f"CREATE TRIGGER watches_observe_insert AFTER INSERT ON watches WHEN {OBSERVATION_CHANGED} BEGIN {OBSERVATION_INSERT} END")
+    cursor.execute(f"CREATE TRIGGER watches_observe_update AFTER UPDATE OF price, currency, condition ON watches WHEN {OBSERVATION_CHANGED} BEGIN {OBSERVATION_INSERT} END")
+
+FILTER_DEFAULTS = {
+    'brand': 'All Brands',
+    'model': 'All Models',
+    'condition': 'All Conditions',
+    'ref': 'All References',
+    'year': 'All Years',
+}
+
+WATCH_COLUMNS = ['product_id', 'brand', 'model', 'ref', 'price', 'currency', 'condition', 'year']
+
+FTS_MIN_LENGTH = 3
+
+GROUP_BY_COLUMNS = ('brand', 'model', 'ref', 'year', 'condition')
+# Columns whose dropdowns, filters and groups use a normalized key rather than the scraped text
+FILTER_KEYS = {'ref': 'ref_key'}
+DEFAULT_PERCENTILES = (0.25, 0.5, 0.75)
+NUMERIC_PRICE = "typeof(price) IN ('integer', 'real')"
+
+def filter_column(column):
+    return FILTER_KEYS.get(column, column)
+
+def setup_indexes(cursor):
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_watches_brand_model_ref_year ON watches(brand, model, ref_key, year)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_watches_model_ref ON watches(model, ref_key)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_watches_ref ON watches(ref_key)")
+    # The table sorts by the ref as shown
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_watches_ref_sort ON watches(ref)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_watches_condition ON watches(condition)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_watches_year ON watches(year)")
+    # Sort keys for the paged results table
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_watches_price ON watches(price)")
+    # Per-currency statistics read percentiles off this index in price order instead of sorting
+    cursor.execute("DROP INDEX IF EXISTS idx_watches_currency")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_watches_currency_price ON watches(currency, price)")
+    # Price range filters compare prices in the base currency
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_watches_price_base ON watches(price_base)")
+    # Blocking index for duplicate detection: candidates share brand, ref key and year and
+    # fall in a narrow price_base range, so each lookup is one range scan
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_watches_block ON watches(brand, ref_key, year, price_base)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_watches_duplicate_of ON watches(duplicate_of) WHERE duplicate_of IS NOT NULL")
+
+def setup_search_index(cursor):
+    # Trigram FTS5 index over the text columns, keyed by watches.rowid, for substring search
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='watches_fts'")
+    if cursor.fetchone() is None:
+        try:
+            cursor.execute("CREATE VIRTUAL TABLE watches_fts USING fts5(brand, model, ref, condition, year, tokenize='trigram')")
+        except sqlite3.OperationalError:
+            print("SQLite has no trigram tokenizer; free-text search will match whole words only.")
+            cursor.execute("CREATE VIRTUAL TABLE watches_fts USING fts5(brand, model, ref, condition, year)")
+        cursor.execute("INSERT INTO watches_fts (rowid, brand, model, ref, condition, year) SELECT rowid, brand, model, ref, condition, year FROM watches")
+
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS watches_fts_insert AFTER INSERT ON watches BEGIN
+        INSERT INTO watches_fts (rowid, brand, model, ref, condition, year)
+        VALUES (NEW.rowid, NEW.brand, NEW.model, NEW.ref, NEW.condition, NEW.year);
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS watches_fts_delete AFTER DELETE ON watches BEGIN
+        DELETE FROM watches_fts WHERE rowid = OLD.rowid;
+    END
+    ''')
+    # Re-scrapes rewrite every column, so only re-index rows whose text actually changed.
+    # Always recreated so an older definition is replaced.
+    cursor.execute("DROP TRIGGER IF EXISTS watches_fts_update")
+    cursor.execute('''
+    CREATE TRIGGER watches_fts_update AFTER UPDATE OF brand, model, ref, condition, year ON watches
+    WHEN OLD.brand IS NOT NEW.brand OR OLD.model IS NOT NEW.model OR OLD.ref IS NOT NEW.ref
+      OR OLD.condition IS NOT NEW.condition OR OLD.year IS NOT NEW.year BEGIN
+        DELETE FROM watches_fts WHERE rowid = OLD.rowid;
+        INSERT INTO watches_fts (rowid, brand, model, ref, condition, year)
+        VALUES (NEW.rowid, NEW.brand, NEW.model, NEW.ref, NEW.condition, NEW.year);
+    END
+    ''')
+
+def setup_facet_summary(cursor):
+    # Per-column value counts kept current by triggers, so the unfiltered dropdowns
+    # don't need a GROUP BY over the whole table at startup. label is the text shown for
+    # the value: the value itself, or for keyed columns the first spelling of the key.
+    cursor.execute("PRAGMA table_info(watch_facets)")
+    columns = [column[1] for column in cursor.fetchall()]
+    if columns and 'label' not in columns:
+        cursor.execute("DROP TABLE watch_facets")
+    if 'label' not in columns:
+        cursor.execute('''
+        CREATE TABLE watch_facets (
+            column_name TEXT NOT NULL,
+            value NOT NULL,
+            count INTEGER NOT NULL,
+            label,
+            PRIMARY KEY (column_name, value)
+        ) WITHOUT ROWID
+        ''')
+        refresh_facet_summary(cursor)
+
+    # One primary-key lookup per column; blank values are skipped like in get_facet_counts
+    add = "".join(f'''
+        INSERT INTO watch_facets (column_name, value, count, label) SELECT '{column}', NEW.{filter_column(column)}, 1, NEW.{column}
+        WHERE NEW.{filter_column(column)} IS NOT NULL AND NEW.{filter_column(column)} != ''
+        ON CONFLICT(column_name, value) DO UPDATE SET count = count + 1, label = MIN(label, excluded.label);''' for column in FILTER_DEFAULTS)
+    remove = "".join(f'''
+        UPDATE watch_facets SET count = count - 1 WHERE column_name = '{column}' AND value = OLD.{filter_column(column)};
+        DELETE FROM watch_facets WHERE column_name = '{column}' AND value = OLD.{filter_column(column)} AND count <= 0;'''
+                     for column in FILTER_DEFAULTS)
+    # A keyed value whose label spelling is removed takes the next spelling still listed
+    remove += "".join(f'''
+        UPDATE watch_facets SET label = (SELECT MIN({column}) FROM watches WHERE {key} = OLD.{key})
+        WHERE column_name = '{column}' AND value = OLD.{key} AND label = OLD.{column};'''
+                      for column, key in FILTER_KEYS.items())
+    key_columns = [filter_column(column) for column in FILTER_DEFAULTS]
+    key_columns += [column for column in FILTER_KEYS if column not in key_columns]
+    changed = " OR ".join(f"OLD.{column} IS NOT NEW.{column}" for column in key_columns)
+    # Always recreated so an older definition is replaced
+    for trigger in ('watches_facets_insert', 'watches_facets_delete', 'watches_facets_update'):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    cursor.execute(f"CREATE TRIGGER watches_facets_insert AFTER INSERT ON watches BEGIN {add} END")
+    cursor.execute(f"CREATE TRIGGER watches_facets_delete AFTER DELETE ON watches BEGIN {remove} END")
+    cursor.execute(f"CREATE TRIGGER watches_facets_update AFTER UPDATE OF {', '.join(key_columns)} ON watches "
+                   f"WHEN {changed} BEGIN {remove} {add} END")
+
+def refresh_facet_summary(cursor):
+    cursor.execute("DELETE FROM watch_facets")
+    for column in FILTER_DEFAULTS:
+        key = filter_column(column)
+        cursor.execute(f"INSERT INTO watch_facets (column_name, value, count, label) SELECT '{column}', {key}, COUNT(*), MIN({column}) "
+                       f"FROM watches WHERE {key} IS NOT NULL AND {key} != '' GROUP BY {key}")
+
+def setup_data_version(cursor):
+    # Single-row counter bumped on every change to watches, including writes from another
+    # process, so anything cached from the table can tell when it went stale
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS data_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0)")
+    # Re-scraping an unchanged listing rewrites the same values, which leaves the version alone
+    changed = " OR ".join(f"OLD.{column} IS NOT NEW.{column}" for column in WATCH_COLUMNS + ['condition_code', 'price_base', 'duplicate_of'])
+    bump = "BEGIN UPDATE data_version SET version = version + 1 WHERE id = 1; END"
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS watches_version_insert AFTER INSERT ON watches {bump}")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS watches_version_delete AFTER DELETE ON watches {bump}")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS watches_version_update AFTER UPDATE ON watches WHEN {changed} {bump}")
+
+def get_data_version(conn):
     cursor = conn.cursor()
+    cursor.execute("SELECT version FROM data_version WHERE id = 1")
+    return cursor.fetchone()[0]
+
+def setup_crawl_tables(cursor):
+    # Persisted crawl frontier: one run at a time, with a job per listing/detail URL
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS crawl_runs (
+        id INTEGER PRIMARY KEY,
+        started_at REAL NOT NULL,
+        finished_at REAL
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS crawl_jobs (
+        run_id INTEGER NOT NULL,
+        url TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        brand TEXT NOT NULL,
+        page INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL DEFAULT 0,
+        last_error TEXT,
+        PRIMARY KEY (run_id, url)
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_crawl_jobs_pending ON crawl_jobs(run_id, status, brand, page)")
+    # The price and currency each product's listing card showed when its detail page was last
+    # saved. Cards use the site's display currency, so incremental crawls compare card to card.
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS listing_cards (
+        product_id TEXT PRIMARY KEY,
+        price REAL NOT NULL,
+        currency TEXT NOT NULL
+    ) WITHOUT ROWID
+    ''')
+
+DEFAULT_BRANDS = {
+    'Rolex': 'https://www.chrono24.co.uk/rolex/index.htm',
+    'Omega': 'https://www.chrono24.co.uk/omega/index.htm',
+    'Patek Philippe': 'https://www.chrono24.co.uk/patekphilippe/index.htm',
+    'Audemars Piguet': 'https://www.chrono24.co.uk/audemarspiguet/index.htm',
+    'Tudor': 'https://www.chrono24.co.uk/tudor/index.htm',
+    'IWC': 'https://www.chrono24.co.uk/iwc/index.htm',
+    'Richard Mille': 'https://www.chrono24.co.uk/richardmille/index.htm',
+    'A Lange & Sohne': 'https://www.chrono24.co.uk/alangesoehne/index.htm'
+}
+
+def setup_brands(cursor):
+    # Brand catalog for the crawler; max_pages is the brand's page budget (NULL = the run's default)
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='brands'")
+    if cursor.fetchone() is not None:
+        return
+    cursor.execute('''
+    CREATE TABLE brands (
+        name TEXT PRIMARY KEY,
+        url TEXT NOT NULL,
+        max_pages INTEGER,
+        enabled INTEGER NOT NULL DEFAULT 1
+    )
+    ''')
+    cursor.executemany("INSERT INTO brands (name, url) VALUES (?, ?)", DEFAULT_BRANDS.items())
+
+def build_filters(brand=None, model=None, condition=None, ref=None, year=None, search=None,
+                  min_price=None, max_price=None, min_year=None, max_year=None, exclude_duplicates=False):
+    # Dropdown values come from DISTINCT so they are matched exactly (and can use the indexes);
+    # a ref matches every spelling with the same key; price/year ranges use the indexed numeric
+    # columns; free text goes through the FTS index. exclude_duplicates keeps one listing per
+    # group of likely duplicates. Returns a " AND ..." clause and its parameters.
+    query = ""
+    params = []
+
+    for column, value in (('brand', brand), ('model', model), ('condition', condition), ('ref', ref), ('year', year)):
+        if value and value != FILTER_DEFAULTS[column]:
+            query += f" AND {filter_column(column)} = ?"
+            params.append(normalize_ref(value) if column == 'ref' else value)
+
+    if exclude_duplicates:
+        query += " AND duplicate_of IS NULL"
+
+    # Ranges are inclusive; prices are compared in the base currency
+    for column, operator, value in (('price_base', '>=', min_price), ('price_base', '<=', max_price),
+                                    ('year', '>=', min_year), ('year', '<=', max_year)):
+        if value is not None:
+            query += f" AND {column} {operator} ?"
+            params.append(value)
+
+    search = search.strip() if search else ''
+    if len(search) >= FTS_MIN_LENGTH:
+        query += " AND rowid IN (SELECT rowid FROM watches_fts WHERE watches_fts MATCH ?)"
+        params.append('"' + search.replace('"', '""') + '"')
+    elif search:
+        # Too short for trigrams; small enough that a scan is acceptable
+        pattern = '%' + search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        query += " AND (" + " OR ".join(f"{column} LIKE ? ESCAPE '\\'" for column in FILTER_DEFAULTS) + ")"
+        params.extend([pattern] * len(FILTER_DEFAULTS))
+
+    return query, params
+
+def setup_currency_rates(cursor):
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='currency_rates'")
+    if cursor.fetchone() is not None:
+        return
+    cursor.execute('''
+    CREATE TABLE currency_rates (
+        currency TEXT PRIMARY KEY,
+        rate REAL NOT NULL,
+        updated_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%f', 'now'))
+    )
+    ''')
+    cursor.executemany("INSERT INTO currency_rates (currency, rate) VALUES (?, ?)", DEFAULT_CURRENCY_RATES.items())
+
+def normalize_watches_table(cursor):
+    # Copies every row through normalize_watch into a table with WATCHES_SCHEMA. Rowids are
+    # kept so watches_fts stays valid; triggers and indexes are recreated by setup_database.
+    conn = cursor.connection
+    rates = get_currency_rates(conn)
+    cursor.execute(f"CREATE TABLE watches_new {WATCHES_SCHEMA}")
+    rows = conn.execute("SELECT rowid, product_id, brand, model, ref, price, currency, condition, year FROM watches ORDER BY rowid")
+    cursor.executemany('''
+    INSERT OR REPLACE INTO watches_new (rowid, product_id, brand, model, ref, price, currency, condition, year,
+                                        condition_code, price_base, ref_key)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', ((row[0], *normalize_watch(row[1:], rates)) for row in rows))
+    cursor.execute("DROP TABLE watches")
+    cursor.execute("ALTER TABLE watches_new RENAME TO watches")
+    observations = conn.execute("SELECT product_id, scraped_at, price FROM watch_observations WHERE typeof(price) = 'text'").fetchall()
+    cursor.executemany("UPDATE watch_observations SET price = ? WHERE product_id = ? AND scraped_at = ?",
+                       [(parse_price(price), product_id, scraped_at) for product_id, scraped_at, price in observations])
+    # Years changed type and refs are counted by key, so recount the facet summary from scratch
+    cursor.execute("DROP TABLE IF EXISTS watch_facets")
+
+def setup_database(db_path=DEFAULT_DB_PATH):
+    conn = open_connection(db_path)
+    cursor = conn.cursor()
+    history_created = setup_history(cursor)
+    setup_currency_rates(cursor)
+    rebuilt = False
     
     # Check if the table exists
     cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='watches'")
@@ -18,18 +486,7 @@ def setup_database():
 
     if not table_exists:
         # If the table doesn't exist, create it with all columns
-        cursor.execute('''
-        CREATE TABLE watches (
-            product_id TEXT PRIMARY KEY,
-            brand TEXT,
-            model TEXT,
-            ref TEXT,
-            price REAL,
-            currency TEXT,
-            condition TEXT,
-            year TEXT
-        )
-        ''')
+        cursor.execute(f"CREATE TABLE watches {WATCHES_SCHEMA}")
     else:
         # If the table exists, check if all columns are present
         cursor.execute("PRAGMA table_info(watches)")
@@ -40,31 +497,79 @@ def setup_database():
             if column not in columns:
                 cursor.execute(f'ALTER TABLE watches ADD COLUMN {column} TEXT')
         
-        # Remove the first_seen_date column if it exists
+        # Remove the first_seen_date column if it exists, keeping it as each watch's first observation
         if 'first_seen_date' in columns:
+            cursor.execute('''
+            INSERT OR IGNORE INTO watch_observations (product_id, scraped_at, price, currency, condition)
+            SELECT product_id, first_seen_date, price, currency, condition FROM watches WHERE first_seen_date IS NOT NULL
+            ''')
             cursor.execute('CREATE TABLE watches_new AS SELECT product_id, brand, model, ref, price, currency, condition, year FROM watches')
             cursor.execute('DROP TABLE watches')
             cursor.execute('ALTER TABLE watches_new RENAME TO watches')
+
+        # Tables from before normalization hold price/year as scraped; rebuild them with typed columns
+        cursor.execute("PRAGMA table_info(watches)")
+        column_types = {column[1]: column[2] for column in cursor.fetchall()}
+        if column_types.get('year') != 'INTEGER' or 'ref_key' not in column_types:
+            normalize_watches_table(cursor)
+            rebuilt = True
+
+    # Tables rebuilt with CREATE TABLE AS lose the primary key; upserts need product_id to be unique.
+    # Once the table has its primary key again the extra index only slows down writes.
+    cursor.execute("PRAGMA table_info(watches)")
+    if any(column[1] == 'product_id' and column[5] for column in cursor.fetchall()):
+        cursor.execute("DROP INDEX IF EXISTS idx_watches_product_id")
+    else:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='index' AND name='idx_watches_product_id'")
+        if cursor.fetchone() is None:
+            cursor.execute("DELETE FROM watches WHERE rowid NOT IN (SELECT MAX(rowid) FROM watches GROUP BY product_id)")
+            cursor.execute("CREATE UNIQUE INDEX idx_watches_product_id ON watches(product_id)")
+
+    if history_created:
+        # Seed the history with the current state of watches scraped before it existed
+        cursor.execute('''
+        INSERT OR IGNORE INTO watch_observations (product_id, scraped_at, price, currency, condition)
+        SELECT product_id, strftime('%Y-%m-%dT%H:%M:%f', 'now'), price, currency, condition FROM watches
+        WHERE product_id NOT IN (SELECT product_id FROM watch_observations)
+        ''')
+    setup_history_triggers(cursor)
+    setup_indexes(cursor)
+    if rebuilt:
+        refresh_duplicates(cursor)
+    setup_search_index(cursor)
+    setup_facet_summary(cursor)
+    setup_data_version(cursor)
+    setup_crawl_tables(cursor)
+    setup_brands(cursor)
     
     conn.commit()
+    cursor.execute("PRAGMA optimize")
     return conn
 
+@metrics.timed('db_write')
 def insert_watch(conn, watch_data):
     cursor = conn.cursor()
+    blocks = block_keys(cursor, [watch_data[0]])
     cursor.execute('''
     INSERT OR REPLACE INTO watches 
-    (product_id, brand, model, ref, price, currency, condition, year)
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    ''', watch_data)
+    (product_id, brand, model, ref, price, currency, condition, year, condition_code, price_base, ref_key)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', normalize_watch(watch_data, get_currency_rates(conn)))
+    mark_duplicates(cursor, blocks | block_keys(cursor, [watch_data[0]]))
     conn.commit()
 
+@metrics.timed('db_write')
 def update_watch(conn, watch_data):
     cursor = conn.cursor()
+    row = normalize_watch(watch_data, get_currency_rates(conn))
+    blocks = block_keys(cursor, [row[0]])
     cursor.execute('''
     UPDATE watches 
-    SET brand = ?, model = ?, ref = ?, price = ?, currency = ?, condition = ?, year = ?
+    SET brand = ?, model = ?, ref = ?, price = ?, currency = ?, condition = ?, year = ?, condition_code = ?, price_base = ?,
+        ref_key = ?
     WHERE product_id = ?
-    ''', (*watch_data[1:], watch_data[0]))
+    ''', (*row[1:], row[0]))
+    mark_duplicates(cursor, blocks | block_keys(cursor, [row[0]]))
     conn.commit()
 
 def check_watch_exists(conn, product_id):
@@ -72,44 +577,420 @@ def check_watch_exists(conn, product_id):
     cursor.execute("SELECT product_id FROM watches WHERE product_id = ?", (product_id,))
     return cursor.fetchone() is not None
 
-def query_watches(conn, brand=None, model=None, condition=None, ref=None, year=None):
+@metrics.timed('db_write')
+def upsert_watches(conn, rows):
+    # Writes a batch of watch rows in one transaction and returns (new_count, updated_count)
+    rates = get_currency_rates(conn)
+    rows = list({row[0]: normalize_watch(row, rates) for row in rows}.values())
+    if not rows:
+        return 0, 0
+
     cursor = conn.cursor()
-    
-    query = "SELECT * FROM watches WHERE 1=1"
-    params = []
+    product_ids = [row[0] for row in rows]
+    existing = set()
+    blocks = set()
+    with conn:
+        for start in range(0, len(product_ids), UPSERT_CHUNK_SIZE):
+            chunk = product_ids[start:start + UPSERT_CHUNK_SIZE]
+            placeholders = ', '.join('?' * len(chunk))
+            cursor.execute(f"SELECT product_id, brand, ref_key, year FROM watches WHERE product_id IN ({placeholders})", chunk)
+            for product_id, brand, ref_key, year in cursor.fetchall():
+                existing.add(product_id)
+                if brand is not None and ref_key is not None:
+                    blocks.add((brand, ref_key, year))
 
-    if brand and brand != "All Brands":
-        query += " AND brand LIKE ?"
-        params.append(f"%{brand}%")
-    
-    if model and model != "All Models":
-        query += " AND model LIKE ?"
-        params.append(f"%{model}%")
-    
-    if condition and condition != "All Conditions":
-        query += " AND condition LIKE ?"
-        params.append(f"%{condition}%")
+        cursor.executemany('''
+        INSERT INTO watches (product_id, brand, model, ref, price, currency, condition, year, condition_code, price_base,
+                             ref_key)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(product_id) DO UPDATE SET
+            brand = excluded.brand, model = excluded.model, ref = excluded.ref, price = excluded.price,
+            currency = excluded.currency, condition = excluded.condition, year = excluded.year,
+            condition_code = excluded.condition_code, price_base = excluded.price_base, ref_key = excluded.ref_key
+        ''', rows)
+        mark_duplicates(cursor, blocks | block_keys(cursor, product_ids))
+
+    metrics.increment('items', len(rows) - len(existing), kind='new')
+    metrics.increment('items', len(existing), kind='updated')
+    return len(rows) - len(existing), len(existing)
+
+def block_keys(cursor, product_ids):
+    # The (brand, ref key, year) duplicate blocks the given listings are in
+    product_ids = list(product_ids)
+    blocks = set()
+    for start in range(0, len(product_ids), UPSERT_CHUNK_SIZE):
+        chunk = product_ids[start:start + UPSERT_CHUNK_SIZE]
+        placeholders = ', '.join('?' * len(chunk))
+        cursor.execute(f"SELECT brand, ref_key, year FROM watches WHERE product_id IN ({placeholders}) "
+                       "AND brand IS NOT NULL AND ref_key IS NOT NULL", chunk)
+        blocks.update(cursor.fetchall())
+    return blocks
+
+def block_duplicates(rows):
+    # rows are one block's (rowid, product_id, price_base) in rowid order. The block's unique
+    # listings are kept sorted by price, so a listing is only compared with the few priced near
+    # it, and a duplicate points at the earliest of them. Returns [(original, product_id)].
+    prices, originals, duplicates = [], [], []
+    for rowid, product_id, price in rows:
+        if price is None:
+            continue
+        low = bisect_left(prices, price / (1 + DUPLICATE_PRICE_TOLERANCE))
+        high = bisect_right(prices, price * (1 + DUPLICATE_PRICE_TOLERANCE))
+        if low < high:
+            duplicates.append((min(originals[low:high])[1], product_id))
+        else:
+            index = bisect_right(prices, price)
+            prices.insert(index, price)
+            originals.insert(index, (rowid, product_id))
+    return duplicates
+
+def mark_duplicates(cursor, blocks):
+    # Recomputes duplicate_of for every listing in the given (brand, ref key, year) blocks,
+    # giving the same marks as refresh_duplicates. Writers pass the blocks of their rows from
+    # before and after the write, so a re-priced or moved listing's old block is rechecked too.
+    # Each block is one range scan of idx_watches_block and only changed marks are written.
+    updates = []
+    for brand, ref_key, year in blocks:
+        if year is None:
+            cursor.execute("SELECT rowid, product_id, price_base, duplicate_of FROM watches INDEXED BY idx_watches_block "
+                           "WHERE brand = ? AND ref_key = ? AND year IS NULL ORDER BY rowid", (brand, ref_key))
+        else:
+            cursor.execute("SELECT rowid, product_id, price_base, duplicate_of FROM watches INDEXED BY idx_watches_block "
+                           "WHERE brand = ? AND ref_key = ? AND year = ? ORDER BY rowid", (brand, ref_key, year))
+        rows = cursor.fetchall()
+        marks = {product_id: original for original, product_id in block_duplicates(row[:3] for row in rows)}
+        updates.extend((marks.get(row[1]), row[1]) for row in rows if marks.get(row[1]) != row[3])
+    cursor.executemany("UPDATE watches SET duplicate_of = ? WHERE product_id = ?", updates)
+
+def refresh_duplicates(cursor):
+    # Recomputes duplicate_of for the whole table in one pass over the rows in block order
+    cursor.execute('''
+    SELECT brand, ref_key, year, rowid, product_id, price_base FROM watches
+    WHERE brand IS NOT NULL AND ref_key IS NOT NULL AND price_base IS NOT NULL
+    ORDER BY brand, ref_key, year, rowid
+    ''')
+    duplicates = []
+    for _, rows in groupby(cursor.fetchall(), key=lambda row: row[:3]):
+        duplicates.extend(block_duplicates(row[3:] for row in rows))
+
+    cursor.execute("UPDATE watches SET duplicate_of = NULL WHERE duplicate_of IS NOT NULL")
+    cursor.executemany("UPDATE watches SET duplicate_of = ? WHERE product_id = ?", duplicates)
+    return len(duplicates)
+
+def get_currency_rates(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT currency, rate FROM currency_rates")
+    return dict(cursor.fetchall())
+
+def set_currency_rate(conn, currency, rate):
+    # Stores the rate (BASE_CURRENCY per unit of currency) and re-prices that currency's watches
+    cursor = conn.cursor()
+    with conn:
+        cursor.execute('''
+        INSERT INTO currency_rates (currency, rate) VALUES (?, ?)
+        ON CONFLICT(currency) DO UPDATE SET rate = excluded.rate, updated_at = strftime('%Y-%m-%dT%H:%M:%f', 'now')
+        ''', (currency, rate))
+        cursor.execute("UPDATE watches SET price_base = price * ? WHERE currency = ?", (rate, currency))
+        # Base prices moved, so the price bands of every block may have too
+        refresh_duplicates(cursor)
+
+def get_known_prices(conn, product_ids):
+    # Bulk lookup of stored prices and the last card seen for each product, returned as
+    # {product_id: (price, currency, card_price, card_currency)}
+    cursor = conn.cursor()
+    product_ids = list(product_ids)
+    known_prices = {}
+    for start in range(0, len(product_ids), UPSERT_CHUNK_SIZE):
+        chunk = product_ids[start:start + UPSERT_CHUNK_SIZE]
+        placeholders = ', '.join('?' * len(chunk))
+        cursor.execute(f'''
+        SELECT watches.product_id, watches.price, watches.currency, listing_cards.price, listing_cards.currency
+        FROM watches LEFT JOIN listing_cards ON listing_cards.product_id = watches.product_id
+        WHERE watches.product_id IN ({placeholders})
+        ''', chunk)
+        known_prices.update((row[0], row[1:]) for row in cursor.fetchall())
+    return known_prices
+
+def save_listing_cards(conn, cards):
+    # Records the listing cards of products whose detail pages were just saved
+    rows = [(card['product_id'], card['price'], card['currency']) for card in cards
+            if card['product_id'] and card['price'] is not None and card['currency'] is not None]
+    cursor = conn.cursor()
+    cursor.executemany('''
+    INSERT INTO listing_cards (product_id, price, currency) VALUES (?, ?, ?)
+    ON CONFLICT(product_id) DO UPDATE SET price = excluded.price, currency = excluded.currency
+    ''', rows)
+    conn.commit()
 
-    if ref and ref != "All References":
-        query += " AND ref LIKE ?"
-        params.append(f"%{ref}%")
+def get_database_path(conn):
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA database_list")
+    path = next((row[2] for row in cursor.fetchall() if row[1] == 'main'), '')
+    if not path:
+        raise ValueError("In-memory databases cannot be shared with a writer thread")
+    return path
+
+class DatabaseWriter:
+    # Owns the only write connection; other threads submit work and get a Future back.
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name='DatabaseWriter', daemon=True)
+        self.thread.start()
+
+    def submit(self, func, *args):
+        future = Future()
+        self.queue.put((func, args, future))
+        return future
+
+    def _run(self):
+        conn = open_connection(self.db_path)
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                func, args, future = item
+                try:
+                    future.set_result(func(conn, *args))
+                except Exception as e:
+                    future.set_exception(e)
+        finally:
+            conn.close()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+class ConnectionManager:
+    # Connections to one database file: setup_database runs on open, reads borrow one of up
+    # to `readers` read-only connections from any thread, and writes are queued to a single
+    # DatabaseWriter. WAL lets the readers keep going while the writer commits.
+    def __init__(self, db_path=DEFAULT_DB_PATH, readers=READ_POOL_SIZE):
+        self.db_path = db_path
+        setup_database(db_path).close()
+        self.available = threading.BoundedSemaphore(readers)
+        self.idle = queue.LifoQueue()
+        self.writer = DatabaseWriter(db_path)
+
+    @contextmanager
+    def reader(self):
+        # Blocks while every reader is in use
+        with self.available:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                conn = open_connection(self.db_path, read_only=True)
+            try:
+                yield conn
+            finally:
+                # A rejected write still opens a transaction, which would pin this reader to an old snapshot
+                if conn.in_transaction:
+                    conn.rollback()
+                self.idle.put(conn)
+
+    def submit(self, func, *args):
+        return self.writer.submit(func, *args)
+
+    def write(self, func, *args):
+        # Runs func(conn, *args) on the writer thread and waits for its result
+        return self.submit(func, *args).result()
+
+    def close(self):
+        self.writer.close()
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+def get_brands(conn, enabled_only=True):
+    # {name: (url, max_pages)} in the order the brands were added
+    cursor = conn.cursor()
+    query = "SELECT name, url, max_pages FROM brands"
+    if enabled_only:
+        query += " WHERE enabled"
+    cursor.execute(query + " ORDER BY rowid")
+    return {name: (url, max_pages) for name, url, max_pages in cursor.fetchall()}
+
+def save_brand(conn, name, url, max_pages=None, enabled=True):
+    cursor = conn.cursor()
+    cursor.execute('''
+    INSERT INTO brands (name, url, max_pages, enabled) VALUES (?, ?, ?, ?)
+    ON CONFLICT(name) DO UPDATE SET url = excluded.url, max_pages = excluded.max_pages, enabled = excluded.enabled
+    ''', (name, url, max_pages, int(enabled)))
+    conn.commit()
+
+def start_crawl_run(conn):
+    # Resumes the latest unfinished run, or starts a new one
+    cursor = conn.cursor()
+    cursor.execute("SELECT id FROM crawl_runs WHERE finished_at IS NULL ORDER BY id DESC LIMIT 1")
+    row = cursor.fetchone()
+    if row is not None:
+        return row[0], True
+    cursor.execute("INSERT INTO crawl_runs (started_at) VALUES (?)", (time.time(),))
+    conn.commit()
+    return cursor.lastrowid, False
+
+def get_crawl_run_start(conn):
+    # When the run start_crawl_run would resume was started, or None if it would start a new one
+    cursor = conn.cursor()
+    cursor.execute("SELECT started_at FROM crawl_runs WHERE finished_at IS NULL ORDER BY id DESC LIMIT 1")
+    row = cursor.fetchone()
+    return row[0] if row is not None else None
+
+def finish_crawl_run(conn, run_id):
+    # A finished run is never resumed, so its jobs (and any left by older finished runs) go
+    cursor = conn.cursor()
+    cursor.execute("UPDATE crawl_runs SET finished_at = ? WHERE id = ?", (time.time(), run_id))
+    cursor.execute("DELETE FROM crawl_jobs WHERE run_id IN (SELECT id FROM crawl_runs WHERE finished_at IS NOT NULL)")
+    conn.commit()
+
+def add_crawl_jobs(conn, run_id, jobs):
+    # jobs are (url, kind, brand, page); URLs already in the run keep their status
+    cursor = conn.cursor()
+    cursor.executemany("INSERT OR IGNORE INTO crawl_jobs (run_id, url, kind, brand, page) VALUES (?, ?, ?, ?, ?)",
+                       [(run_id, *job) for job in jobs])
+    conn.commit()
+
+def get_crawl_jobs(conn, run_id, brand=None, page=None, kind=None, due_only=True):
+    # Pending jobs as (url, kind, brand, page, attempts), in crawl order
+    cursor = conn.cursor()
+    query = "SELECT url, kind, brand, page, attempts FROM crawl_jobs WHERE run_id = ? AND status = 'pending'"
+    params = [run_id]
 
-    if year and year != "All Years":
-        query += " AND year LIKE ?"
-        params.append(f"%{year}%")
+    for column, value in (('brand', brand), ('page', page), ('kind', kind)):
+        if value is not None:
+            query += f" AND {column} = ?"
+            params.append(value)
+
+    if due_only:
+        query += " AND next_attempt_at <= ?"
+        params.append(time.time())
+
+    cursor.execute(query + " ORDER BY brand, page, kind DESC, url", params)
+    return cursor.fetchall()
+
+def get_next_crawl_attempt(conn, run_id):
+    # Earliest time a pending job may run, or None when nothing is pending
+    cursor = conn.cursor()
+    cursor.execute("SELECT MIN(next_attempt_at) FROM crawl_jobs WHERE run_id = ? AND status = 'pending'", (run_id,))
+    return cursor.fetchone()[0]
+
+def complete_crawl_jobs(conn, run_id, urls, status='done'):
+    cursor = conn.cursor()
+    cursor.executemany("UPDATE crawl_jobs SET status = ?, last_error = NULL WHERE run_id = ? AND url = ?",
+                       [(status, run_id, url) for url in urls])
+    conn.commit()
+
+def fail_crawl_job(conn, run_id, url, error, max_attempts=3, backoff=5.0):
+    # Exponential backoff between attempts; gives up after max_attempts
+    cursor = conn.cursor()
+    cursor.execute('''
+    UPDATE crawl_jobs SET
+        attempts = attempts + 1,
+        last_error = ?,
+        status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END,
+        next_attempt_at = ? + ? * (1 << attempts)
+    WHERE run_id = ? AND url = ?
+    ''', (str(error), max_attempts, time.time(), backoff, run_id, url))
+    conn.commit()
+
+def query_watches(conn, brand=None, model=None, condition=None, ref=None, year=None, search=None,
+                  min_price=None, max_price=None, min_year=None, max_year=None, exclude_duplicates=False):
+    cursor = conn.cursor()
+    
+    filter_query, params = build_filters(brand, model, condition, ref, year, search, min_price, max_price, min_year, max_year,
+                                         exclude_duplicates)
+    query = f"SELECT {', '.join(WATCH_COLUMNS)} FROM watches WHERE 1=1" + filter_query
 
     cursor.execute(query, params)
     return cursor.fetchall()
 
+def count_watches(conn, brand=None, model=None, condition=None, ref=None, year=None, search=None,
+                  min_price=None, max_price=None, min_year=None, max_year=None, exclude_duplicates=False):
+    cursor = conn.cursor()
+    filter_query, params = build_filters(brand, model, condition, ref, year, search, min_price, max_price, min_year, max_year,
+                                         exclude_duplicates)
+    cursor.execute("SELECT COUNT(*) FROM watches WHERE 1=1" + filter_query, params)
+    return cursor.fetchone()[0]
+
+def query_watches_page(conn, limit, after=None, order_by=None, descending=False, brand=None, model=None,
+                       condition=None, ref=None, year=None, search=None, min_price=None, max_price=None, min_year=None, max_year=None,
+                       exclude_duplicates=False):
+    # One page of query_watches results, sorted in SQL; rowid breaks ties so pages are stable.
+    # Rows are the WATCH_COLUMNS followed by the rowid. Pages are read by keyset rather than
+    # OFFSET: after is the (sort value, rowid) of the previous page's last row, so every page is
+    # one index range however far down it is. NULLs sort first ascending and last descending,
+    # and are read as a range of their own.
+    if order_by is not None and order_by not in WATCH_COLUMNS:
+        raise ValueError(f"Cannot sort watches by {order_by!r}")
+
+    cursor = conn.cursor()
+    filter_query, params = build_filters(brand, model, condition, ref, year, search, min_price, max_price, min_year, max_year,
+                                         exclude_duplicates)
+    select = f"SELECT {', '.join(WATCH_COLUMNS)}, rowid FROM watches WHERE 1=1" + filter_query
+    direction, operator = ("DESC", "<") if descending else ("ASC", ">")
+
+    if order_by is None:
+        after_query, after_params = ("", []) if after is None else (f" AND rowid {operator} ?", [after[1]])
+        cursor.execute(select + after_query + f" ORDER BY rowid {direction} LIMIT ?", params + after_params + [limit])
+        return cursor.fetchall()
+
+    ranges = [True, False] if not descending else [False, True]  # whether each range is the NULLs
+    if after is not None:
+        ranges = ranges[ranges.index(after[0] is None):]
+
+    rows = []
+    for nulls in ranges:
+        if after is None:
+            range_query, range_params = f" AND {order_by} IS {'' if nulls else 'NOT '}NULL", []
+        elif nulls:
+            range_query, range_params = f" AND {order_by} IS NULL AND rowid {operator} ?", [after[1]]
+        else:
+            range_query, range_params = f" AND ({order_by}, rowid) {operator} (?, ?)", list(after)
+        cursor.execute(select + range_query + f" ORDER BY {order_by} {direction}, rowid {direction} LIMIT ?",
+                       params + range_params + [limit - len(rows)])
+        rows.extend(cursor.fetchall())
+        if len(rows) >= limit:
+            break
+        after = None
+    return rows
+
 def clear_database(conn):
     cursor = conn.cursor()
     cursor.execute("DELETE FROM watches")
+    cursor.execute("DELETE FROM watch_observations")
+    cursor.execute("DELETE FROM listing_cards")
     conn.commit()
     print("Database cleared.")
 
+def get_price_history(conn, product_id=None, start=None, end=None):
+    # Observations ordered by time; start/end are ISO timestamps or dates
+    cursor = conn.cursor()
+
+    query = "SELECT product_id, scraped_at, price, currency, condition FROM watch_observations WHERE 1=1"
+    params = []
+
+    if product_id is not None:
+        query += " AND product_id = ?"
+        params.append(product_id)
+
+    if start is not None:
+        query += " AND scraped_at >= ?"
+        params.append(start)
+
+    if end is not None:
+        query += " AND scraped_at < ?"
+        params.append(end)
+
+    query += " ORDER BY product_id, scraped_at" if product_id is None else " ORDER BY scraped_at"
+    cursor.execute(query, params)
+    return cursor.fetchall()
+
 def get_all_watches(conn):
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM watches")
+    cursor.execute(f"SELECT {', '.join(WATCH_COLUMNS)} FROM watches")
     return cursor.fetchall()
 
 def get_unique_values(conn, column):
@@ -144,71 +1025,137 @@ def test_watch_data(watch_data):
 
         # Add this function to database.py
 
-def get_watch_statistics(conn, brand=None, model=None, condition=None, ref=None, year=None):
+def get_watch_statistics(conn, brand=None, model=None, condition=None, ref=None, year=None, search=None,
+                         min_price=None, max_price=None, min_year=None, max_year=None, exclude_duplicates=False):
+    # Overall avg/max/min across all currencies; see get_price_statistics for a per-currency breakdown
     cursor = conn.cursor()
-    
-    query = "SELECT price FROM watches WHERE 1=1"
-    params = []
 
-    if brand and brand != "All Brands":
-        query += " AND brand LIKE ?"
-        params.append(f"%{brand}%")
-    
-    if model and model != "All Models":
-        query += " AND model LIKE ?"
-        params.append(f"%{model}%")
-    
-    if condition and condition != "All Conditions":
-        query += " AND condition LIKE ?"
-        params.append(f"%{condition}%")
-
-    if ref and ref != "All References":
-        query += " AND ref LIKE ?"
-        params.append(f"%{ref}%")
-
-    if year and year != "All Years":
-        query += " AND year LIKE ?"
-        params.append(f"%{year}%")
+    filter_query, params = build_filters(brand, model, condition, ref, year, search, min_price, max_price, min_year, max_year,
+                                         exclude_duplicates)
+    query = f"SELECT AVG(price), MAX(price), MIN(price) FROM watches WHERE {NUMERIC_PRICE}" + filter_query
 
     cursor.execute(query, params)
-    prices = [row[0] for row in cursor.fetchall() if row[0] is not None]
-    
-    if not prices:
-        return None, None, None
+    avg_price, max_price, min_price = cursor.fetchone()
 
-    avg_price = sum(prices) / len(prices)
-    max_price = max(prices)
-    min_price = min(prices)
+    if avg_price is None:
+        return None, None, None
 
     return format_price(avg_price), format_price(max_price), format_price(min_price)
 
+def percentile_key(fraction):
+    return f"p{round(fraction * 100):02d}"
+
+def percentile(prices_from, count, fraction):
+    # Linear interpolation between the two ranks around 1 + fraction * (count - 1);
+    # prices_from(offset) gives the (up to two) prices from that offset in price order
+    position = 1 + fraction * (count - 1)
+    lower = int(position)
+    prices = prices_from(lower - 1)
+    if len(prices) < 2 or position == lower:
+        return prices[0]
+    return prices[0] * (1 - (position - lower)) + prices[1] * (position - lower)
+
+def get_price_statistics(conn, group_by=None, percentiles=DEFAULT_PERCENTILES, brand=None, model=None,
+                         condition=None, ref=None, year=None, search=None, min_price=None, max_price=None, min_year=None, max_year=None,
+                         exclude_duplicates=False):
+    # Aggregates computed in SQL, one row per currency (and per group_by column values) so
+    # prices in different currencies are never mixed. Each row is a dict with the group
+    # columns, currency, count, avg, min, max, median and a pNN key per percentile.
+    group_by = list(group_by or [])
+    for column in group_by:
+        if column not in GROUP_BY_COLUMNS:
+            raise ValueError(f"Cannot group statistics by {column!r}")
+
+    # Refs are grouped by key, so every spelling of a reference lands in one row
+    partition = ', '.join([filter_column(column) for column in group_by] + ['currency'])
+    percentiles = sorted(set(percentiles) | {0.5})
+
+    filter_query, params = build_filters(brand, model, condition, ref, year, search, min_price, max_price, min_year, max_year,
+                                         exclude_duplicates)
+    cursor = conn.cursor()
+    keys = group_by + ['currency', 'count', 'avg', 'min', 'max']
+    statistics = []
+    if not group_by:
+        # Per currency (what the GUI shows) the aggregates come first and each percentile is
+        # then a single row read at an offset along idx_watches_currency_price, so nothing is
+        # sorted and memory stays flat however many rows match
+        cursor.execute(f"SELECT currency, COUNT(*), AVG(price), MIN(price), MAX(price) FROM watches "
+                       f"WHERE {NUMERIC_PRICE}{filter_query} GROUP BY currency ORDER BY currency", params)
+        for row in cursor.fetchall():
+            statistics.append(dict(zip(keys, row)))
+            currency_query = (f"SELECT price FROM watches WHERE {NUMERIC_PRICE}{filter_query} AND currency IS ? "
+                              "ORDER BY price LIMIT 2 OFFSET ?")
+            prices_from = lambda offset: [price for price, in cursor.execute(currency_query, params + [row[0], offset])]
+            for fraction in percentiles:
+                statistics[-1][percentile_key(fraction)] = percentile(prices_from, row[1], fraction)
+    else:
+        # Many small groups: one pass in group and price order, holding one group's prices at a time
+        cursor.execute(f"SELECT {partition}, price FROM watches WHERE {NUMERIC_PRICE}{filter_query} "
+                       f"ORDER BY {partition}, price", params)
+        for group, rows in groupby(cursor, key=lambda row: row[:-1]):
+            prices = [row[-1] for row in rows]
+            statistics.append(dict(zip(keys, (*group, len(prices), sum(prices) / len(prices), prices[0], prices[-1]))))
+            for fraction in percentiles:
+                statistics[-1][percentile_key(fraction)] = percentile(lambda offset: prices[offset:offset + 2],
+                                                                      len(prices), fraction)
+
+    for row_statistics in statistics:
+        row_statistics['median'] = row_statistics['p50']
+    return statistics
+
 # Add this new function to database.py
 
-def get_filtered_values(conn, column, brand=None, model=None, condition=None, ref=None, year=None):
+def get_filtered_values(conn, column, brand=None, model=None, condition=None, ref=None, year=None, search=None,
+                        min_price=None, max_price=None, min_year=None, max_year=None, exclude_duplicates=False):
     cursor = conn.cursor()
     
-    query = f"SELECT DISTINCT {column} FROM watches WHERE {column} IS NOT NULL AND {column} != ''"
-    params = []
+    filter_query, params = build_filters(brand, model, condition, ref, year, search, min_price, max_price, min_year, max_year,
+                                         exclude_duplicates)
+    column = filter_column(column)
+    query = f"SELECT DISTINCT {column} FROM watches WHERE {column} IS NOT NULL AND {column} != ''" + filter_query
 
-    if brand and brand != "All Brands":
-        query += " AND brand LIKE ?"
-        params.append(f"%{brand}%")
-    
-    if model and model != "All Models":
-        query += " AND model LIKE ?"
-        params.append(f"%{model}%")
-    
-    if condition and condition != "All Conditions":
-        query += " AND condition LIKE ?"
-        params.append(f"%{condition}%")
+    cursor.execute(query, params)
+    return [row[0] for row in cursor.fetchall()]
 
-    if ref and ref != "All References":
-        query += " AND ref LIKE ?"
-        params.append(f"%{ref}%")
+def get_facet_summary(conn):
+    # Unfiltered facet counts from the trigger-maintained watch_facets table
+    cursor = conn.cursor()
+    cursor.execute("SELECT column_name, value, count, label FROM watch_facets")
+    facets = {column: [] for column in FILTER_DEFAULTS}
+    for column, value, count, label in cursor:
+        facets[column].append((value, count, label))
+    for values in facets.values():
+        values.sort(key=lambda item: str(item[2]))
+    return facets
 
-    if year and year != "All Years":
-        query += " AND year LIKE ?"
-        params.append(f"%{year}%")
+def get_facet_counts(conn, brand=None, model=None, condition=None, ref=None, year=None, search=None,
+                     min_price=None, max_price=None, min_year=None, max_year=None, exclude_duplicates=False):
+    # Distinct values and their counts for every filter column in one round trip. Each
+    # column's counts apply all the other filters but not its own, so a dropdown keeps
+    # offering its alternatives. Returns {column: [(value, count, label), ...]}, where label
+    # is the value as shown: for refs, the first spelling of the ref key.
+    filters = {'brand': brand, 'model': model, 'condition': condition, 'ref': ref, 'year': year}
+    ranges = {'min_price': min_price, 'max_price': max_price, 'min_year': min_year, 'max_year': max_year}
+    if not any(filters.values()) and not search and not exclude_duplicates and all(value is None for value in ranges.values()):
+        return get_facet_summary(conn)
 
-    cursor.execute(query, params)
-    return [row[0] for row in cursor.fetchall()]
\ No newline at end of file
+    queries = []
+    params = []
+
+    for column in FILTER_DEFAULTS:
+        other_filters = dict(filters, **{column: None})
+        filter_query, filter_params = build_filters(search=search, exclude_duplicates=exclude_duplicates, **other_filters, **ranges)
+        key = filter_column(column)
+        queries.append(f"SELECT '{column}', {key}, COUNT(*), MIN({column}) FROM watches "
+                       f"WHERE {key} IS NOT NULL AND {key} != ''{filter_query} GROUP BY {key}")
+        params.extend(filter_params)
+
+    cursor = conn.cursor()
+    cursor.execute(" UNION ALL ".join(queries), params)
+
+    facets = {column: [] for column in FILTER_DEFAULTS}
+    for column, value, count, label in cursor:
+        facets[column].append((value, count, label))
+    for values in facets.values():
+        values.sort(key=lambda item: str(item[2]))
+    return facets
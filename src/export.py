@@ -0,0 +1,154 @@
+import csv
+import json
+import os
+from database import WATCH_COLUMNS, upsert_watches, parse_price
+
+BATCH_SIZE = 10_000
+FORMATS = ('csv', 'jsonl', 'parquet')
+# Column name -> type for each exported table; the types are used for the Parquet schema
+TABLES = {
+    'watch_observations': {'product_id': 'string', 'scraped_at': 'string', 'price': 'float', 'currency': 'string',
+                           'condition': 'string'},
+    'watches': {'product_id': 'string', 'brand': 'string', 'model': 'string', 'ref': 'string', 'price': 'float',
+                'currency': 'string', 'condition': 'string', 'year': 'int', 'condition_code': 'int',
+                'price_base': 'float', 'ref_key': 'string', 'duplicate_of': 'string'},
+}
+
+
+def format_for(path):
+    extension = os.path.splitext(path)[1].lstrip('.').lower()
+    if extension not in FORMATS:
+        raise ValueError(f"Unsupported dump format {extension!r}; use one of {', '.join(FORMATS)}")
+    return extension
+
+
+def iter_batches(conn, table):
+    # Streams the table in BATCH_SIZE row lists so memory stays bounded on large databases
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT {', '.join(TABLES[table])} FROM {table}")
+    while True:
+        rows = cursor.fetchmany(BATCH_SIZE)
+        if not rows:
+            break
+        yield rows
+
+
+def export_table(conn, table, path):
+    # Writes one table as CSV, JSON lines or Parquet (picked by the file extension); returns the row count
+    columns = list(TABLES[table])
+    file_format = format_for(path)
+    count = 0
+
+    if file_format == 'parquet':
+        pyarrow, parquet = import_pyarrow()
+        types = {'string': pyarrow.string(), 'float': pyarrow.float64(), 'int': pyarrow.int64()}
+        schema = pyarrow.schema([(column, types[column_type]) for column, column_type in TABLES[table].items()])
+        with parquet.ParquetWriter(path, schema, compression='zstd') as writer:
+            for rows in iter_batches(conn, table):
+                arrays = [pyarrow.array([coerce(row[index], column_type) for row in rows], type=types[column_type])
+                          for index, column_type in enumerate(TABLES[table].values())]
+                writer.write_batch(pyarrow.RecordBatch.from_arrays(arrays, schema=schema))
+                count += len(rows)
+        return count
+
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f) if file_format == 'csv' else None
+        if writer is not None:
+            writer.writerow(columns)
+        for rows in iter_batches(conn, table):
+            if writer is not None:
+                writer.writerows(rows)
+            else:
+                f.writelines(json.dumps(dict(zip(columns, row))) + "\n" for row in rows)
+            count += len(rows)
+    return count
+
+
+def export_database(conn, directory, file_format='csv'):
+    # One file per table, e.g. dump/watches.parquet and dump/watch_observations.parquet
+    os.makedirs(directory, exist_ok=True)
+    counts = {}
+    for table in TABLES:
+        path = os.path.join(directory, f"{table}.{file_format}")
+        counts[table] = export_table(conn, table, path)
+        print(f"Exported {counts[table]} rows from {table} to {path}")
+    return counts
+
+
+def read_batches(path):
+    # Yields lists of row dicts from a dump file; CSV's empty strings come back as None
+    file_format = format_for(path)
+    if file_format == 'parquet':
+        _, parquet = import_pyarrow()
+        for batch in parquet.ParquetFile(path).iter_batches(batch_size=BATCH_SIZE):
+            yield batch.to_pylist()
+        return
+
+    with open(path, encoding='utf-8', newline='') as f:
+        if file_format == 'csv':
+            records = ({key: value if value != '' else None for key, value in record.items()} for record in csv.DictReader(f))
+        else:
+            records = (json.loads(line) for line in f if line.strip())
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) == BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def import_table(conn, table, path):
+    # Loads a dump in BATCH_SIZE transactions. Watches go through upsert_watches, so
+    # price/year/condition are normalized and price_base uses this database's rates.
+    count = 0
+    cursor = conn.cursor()
+    for records in read_batches(path):
+        if table == 'watches':
+            upsert_watches(conn, [[record.get(column) for column in WATCH_COLUMNS] for record in records])
+        else:
+            columns = list(TABLES[table])
+            with conn:
+                cursor.executemany(f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                                   [[coerce(record.get(column), TABLES[table][column]) for column in columns]
+                                    for record in records])
+        count += len(records)
+    return count
+
+
+def import_database(conn, directory):
+    # History first: the watch insert trigger then sees each watch's latest observation
+    # already present and doesn't add a duplicate one
+    counts = {}
+    for table in TABLES:
+        path = next((os.path.join(directory, f"{table}.{file_format}") for file_format in FORMATS
+                     if os.path.exists(os.path.join(directory, f"{table}.{file_format}"))), None)
+        if path is None:
+            print(f"No dump of {table} in {directory}, skipping")
+            continue
+        counts[table] = import_table(conn, table, path)
+        print(f"Imported {counts[table]} rows into {table} from {path}")
+    return counts
+
+
+def coerce(value, column_type):
+    if value is None:
+        return None
+    if column_type == 'string':
+        return str(value)
+    if column_type == 'float':
+        return parse_price(value)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet as parquet
+    except ImportError:
+        raise RuntimeError("Parquet dumps need pyarrow (pip install pyarrow)")
+    return pyarrow, parquet
@@ -1,13 +1,50 @@
-from PyQt6.QtWidgets import QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLabel, QComboBox, QTableWidget, QTableWidgetItem, QMessageBox, QHeaderView
-from PyQt6.QtCore import Qt, QSignalBlocker
-from PyQt6.QtGui import QColor
-from database import get_unique_values, query_watches, get_all_watches, clear_database, get_watch_statistics, format_price, get_filtered_values
+from PyQt6.QtWidgets import QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLabel, QComboBox, QLineEdit, QTableView, QAbstractItemView, QMessageBox, QHeaderView, QCheckBox
+from PyQt6.QtGui import QDoubleValidator, QIntValidator
+import threading
+from PyQt6.QtCore import Qt, QSignalBlocker, QThread, pyqtSignal
+from database import clear_database, format_price, BASE_CURRENCY
+from cli import ScrapeInProgress
+from query_cache import get_price_statistics, get_facet_counts
+from table_model import WatchTableModel, FacetListModel
+
+FILTER_COLUMNS = ['brand', 'model', 'condition', 'ref', 'year']
+RANGE_FILTERS = [('min_price', f"Min price ({BASE_CURRENCY})", float), ('max_price', f"Max price ({BASE_CURRENCY})", float),
+                 ('min_year', "From year", int), ('max_year', "To year", int)]
+
+class ScrapeWorker(QThread):
+    # Runs the scrape on the database's writer connection and waits for it here, so the
+    # window stays responsive; WAL mode lets the GUI's readers keep going while it writes.
+    progress = pyqtSignal(dict)
+    failed = pyqtSignal(str)
+
+    def __init__(self, database, scrape_function, parent=None):
+        super().__init__(parent)
+        self.database = database
+        self.scrape_function = scrape_function
+        self.cancel_event = threading.Event()
+        self.busy = False
+
+    def run(self):
+        try:
+            self.database.write(self.scrape, self.progress.emit, self.cancel_event)
+        except ScrapeInProgress:
+            # The daemon or a manual run is scraping; nothing was written
+            self.busy = True
+        except Exception as e:
+            self.failed.emit(str(e))
+
+    def scrape(self, conn, progress, cancel_event):
+        return self.scrape_function(conn, progress=progress, cancel_event=cancel_event)
+
+    def cancel(self):
+        self.cancel_event.set()
 
 class WatchDatabaseGUI(QMainWindow):
-    def __init__(self, db_connection, initial_scrape_function):
+    def __init__(self, database, initial_scrape_function):
         super().__init__()
-        self.db_connection = db_connection
+        self.database = database
         self.initial_scrape_function = initial_scrape_function
+        self.scrape_worker = None
         self.setWindowTitle("Watch Database Query")
         self.setGeometry(100, 100, 1000, 600)
 
@@ -31,6 +68,25 @@ class WatchDatabaseGUI(QMainWindow):
         for dropdown in self.dropdowns:
             dropdown.currentTextChanged.connect(self.update_dropdowns)
 
+        # Free-text search over brand/model/ref/condition/year
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("Search (e.g. part of a reference)")
+        self.search_input.returnPressed.connect(self.query_database)
+
+        # Price (in the base currency) and year ranges
+        self.range_inputs = {}
+        for name, placeholder, value_type in RANGE_FILTERS:
+            range_input = QLineEdit()
+            range_input.setPlaceholderText(placeholder)
+            range_input.setValidator(QIntValidator(0, 9999) if value_type is int else QDoubleValidator(0, 1e12, 2))
+            range_input.editingFinished.connect(self.update_dropdowns)
+            range_input.returnPressed.connect(self.query_database)
+            self.range_inputs[name] = range_input
+
+        # Counts and statistics over one listing per group of likely duplicates
+        self.hide_duplicates = QCheckBox("Hide likely duplicates")
+        self.hide_duplicates.toggled.connect(self.update_dropdowns)
+
         # Create buttons
         query_button = QPushButton("Query Database")
         query_button.clicked.connect(self.query_database)
@@ -38,22 +94,26 @@ class WatchDatabaseGUI(QMainWindow):
         print_all_button = QPushButton("Print All Watches")
         print_all_button.clicked.connect(self.print_all_watches)
 
-        clear_button = QPushButton("Clear Database")
-        clear_button.clicked.connect(self.clear_database)
+        self.clear_button = QPushButton("Clear Database")
+        self.clear_button.clicked.connect(self.clear_database)
+
+        self.initial_scrape_button = QPushButton("Initial Scrape")
+        self.initial_scrape_button.clicked.connect(self.perform_initial_scrape)
 
-        initial_scrape_button = QPushButton("Initial Scrape")
-        initial_scrape_button.clicked.connect(self.perform_initial_scrape)
+        self.cancel_scrape_button = QPushButton("Cancel Scrape")
+        self.cancel_scrape_button.setEnabled(False)
+        self.cancel_scrape_button.clicked.connect(self.cancel_scrape)
 
-        # Create table for results
-        self.result_table = QTableWidget()
-        self.result_table.setColumnCount(8)
-        self.result_table.setHorizontalHeaderLabels(["ID", "Brand", "Model", "Ref", "Price", "Currency", "Condition", "Year"])
+        # Create table for results; rows are paged in from sqlite as the view scrolls
+        self.result_model = WatchTableModel(self.database, parent=self)
+        self.result_table = QTableView()
+        self.result_table.setModel(self.result_model)
         self.result_table.horizontalHeader().setStretchLastSection(True)
-        self.result_table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        self.result_table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
         
-        # Enable sorting
+        # Enable sorting; the model re-queries with ORDER BY
+        self.result_table.horizontalHeader().setSortIndicator(-1, Qt.SortOrder.AscendingOrder)
         self.result_table.setSortingEnabled(True)
-        self.result_table.horizontalHeader().sectionClicked.connect(self.header_clicked)
 
         # Create label for statistics
         self.stats_label = QLabel()
@@ -62,14 +122,22 @@ class WatchDatabaseGUI(QMainWindow):
         dropdown_layout = QHBoxLayout()
         for dropdown in self.dropdowns:
             dropdown_layout.addWidget(dropdown)
+        dropdown_layout.addWidget(self.search_input)
+
+        range_layout = QHBoxLayout()
+        for range_input in self.range_inputs.values():
+            range_layout.addWidget(range_input)
+        range_layout.addWidget(self.hide_duplicates)
 
         button_layout = QHBoxLayout()
         button_layout.addWidget(query_button)
         button_layout.addWidget(print_all_button)
-        button_layout.addWidget(clear_button)
-        button_layout.addWidget(initial_scrape_button)
+        button_layout.addWidget(self.clear_button)
+        button_layout.addWidget(self.initial_scrape_button)
+        button_layout.addWidget(self.cancel_scrape_button)
 
         self.layout.addLayout(dropdown_layout)
+        self.layout.addLayout(range_layout)
         self.layout.addLayout(button_layout)
         self.layout.addWidget(self.stats_label)
         self.layout.addWidget(self.result_table)
@@ -79,127 +147,88 @@ class WatchDatabaseGUI(QMainWindow):
 
     def create_dropdown(self, label):
         dropdown = QComboBox()
-        dropdown.addItem(f"All {label}s")
+        dropdown.setModel(FacetListModel(f"All {label}s", dropdown))
+        # Sizing to contents would measure every value; uniform rows keep the popup fast
+        dropdown.setSizeAdjustPolicy(QComboBox.SizeAdjustPolicy.AdjustToMinimumContentsLengthWithIcon)
+        dropdown.setMinimumContentsLength(16)
+        dropdown.view().setUniformItemSizes(True)
         return dropdown
 
     def populate_dropdowns(self):
-        for dropdown, column in zip(self.dropdowns, ['brand', 'model', 'condition', 'ref', 'year']):
-            self.update_dropdown(dropdown, column)
-
-    def update_dropdowns(self):
-        sender = self.sender()
-        for dropdown, column in zip(self.dropdowns, ['brand', 'model', 'condition', 'ref', 'year']):
+        self.update_dropdowns(refresh_all=True)
+
+    def update_dropdowns(self, _text=None, refresh_all=False):
+        # One facet query refreshes every other dropdown; the changed one keeps its values
+        sender = None if refresh_all else self.sender()
+        with self.database.reader() as conn:
+            facets = get_facet_counts(conn, **self.current_filters())
+        for dropdown, column in zip(self.dropdowns, FILTER_COLUMNS):
             if dropdown != sender:
-                self.update_dropdown(dropdown, column)
+                self.update_dropdown(dropdown, column, facets[column])
 
-    def update_dropdown(self, dropdown, column):
-        current_text = dropdown.currentText()
+    def update_dropdown(self, dropdown, column, values):
+        current_value = dropdown.currentData()
         
         with QSignalBlocker(dropdown):
-            dropdown.clear()
-            dropdown.addItem(f"All {column.capitalize()}s")
-            
-            filters = {
-                'brand': self.brand_dropdown.currentText(),
-                'model': self.model_dropdown.currentText(),
-                'condition': self.condition_dropdown.currentText(),
-                'ref': self.ref_dropdown.currentText(),
-                'year': self.year_dropdown.currentText()
-            }
-            
-            # Remove the current column from filters and "All X" values
-            filters.pop(column)
-            filters = {k: v for k, v in filters.items() if not v.startswith('All ')}
-
-            values = get_filtered_values(self.db_connection, column, **filters)
-            dropdown.addItems(values)
-
-            if current_text in values or current_text == f"All {column.capitalize()}s":
-                dropdown.setCurrentText(current_text)
-            else:
-                dropdown.setCurrentIndex(0)
+            dropdown.model().set_values(values)
+            dropdown.setCurrentIndex(max(dropdown.model().row_of(current_value), 0))
+
+    def current_filters(self):
+        # Item data holds the filter value (the key for refs); the "All ..." entry has none
+        filters = {column: dropdown.currentData() for dropdown, column in zip(self.dropdowns, FILTER_COLUMNS)
+                   if dropdown.currentData() is not None}
+        for name, _, value_type in RANGE_FILTERS:
+            try:
+                filters[name] = value_type(self.range_inputs[name].text().replace(',', ''))
+            except ValueError:
+                pass  # empty or still being typed
+        if self.hide_duplicates.isChecked():
+            filters['exclude_duplicates'] = True
+        return filters
 
     def query_database(self):
-        filters = {
-            'brand': self.brand_dropdown.currentText(),
-            'model': self.model_dropdown.currentText(),
-            'condition': self.condition_dropdown.currentText(),
-            'ref': self.ref_dropdown.currentText(),
-            'year': self.year_dropdown.currentText()
-        }
-        filters = {k: v for k, v in filters.items() if not v.startswith('All ')}
-
-        results = query_watches(self.db_connection, **filters)
-        stats = get_watch_statistics(self.db_connection, **filters)
-
-        self.display_results(results, stats)
-
-    def display_results(self, results, stats):
-        if not results:
-            self.result_table.setRowCount(0)
+        filters = self.current_filters()
+        filters['search'] = self.search_input.text()
+
+        with self.database.reader() as conn:
+            stats = get_price_statistics(conn, **filters)
+
+        self.display_results(filters, stats)
+
+    def display_results(self, filters, stats):
+        self.result_model.set_filters(filters)
+        if not self.result_model.total_rows:
             self.stats_label.setText("No matches found.")
             return
 
-        avg_price, max_price, min_price = stats
-        stats_text = f"Total watches found: {len(results)}\n"
+        stats_text = f"Total watches found: {self.result_model.total_rows}"
         
-        if avg_price is not None:
-            stats_text += f"Average Price: {format_price(avg_price)}\n"
-            stats_text += f"Highest Price: {format_price(max_price)}\n"
-            stats_text += f"Lowest Price: {format_price(min_price)}"
+        if stats:
+            # One line per currency; prices in different currencies are not averaged together
+            for currency_stats in stats:
+                stats_text += (f"\n{currency_stats['currency']} ({currency_stats['count']}): "
+                               f"Average {format_price(currency_stats['avg'])}, "
+                               f"Median {format_price(currency_stats['median'])}, "
+                               f"Highest {format_price(currency_stats['max'])}, "
+                               f"Lowest {format_price(currency_stats['min'])}")
         else:
-            stats_text += "No price data available for the selected criteria."
+            stats_text += "\nNo price data available for the selected criteria."
         
         self.stats_label.setText(stats_text)
 
-        self.result_table.setSortingEnabled(False)  # Disable sorting while updating
-        self.result_table.setRowCount(len(results))
-        for row, watch in enumerate(results):
-            for col, item in enumerate(watch):
-                table_item = QTableWidgetItem()
-                if col == 0:  # ID column
-                    table_item.setData(Qt.ItemDataRole.DisplayRole, int(item))
-                elif col == 4:  # Price column
-                    try:
-                        table_item.setData(Qt.ItemDataRole.DisplayRole, float(item))
-                    except ValueError:
-                        table_item.setData(Qt.ItemDataRole.DisplayRole, item)
-                    table_item.setText(format_price(item))
-                elif col == 7:  # Year column
-                    try:
-                        table_item.setData(Qt.ItemDataRole.DisplayRole, int(item))
-                    except ValueError:
-                        table_item.setData(Qt.ItemDataRole.DisplayRole, item)
-                else:
-                    table_item.setData(Qt.ItemDataRole.DisplayRole, str(item))
-                self.result_table.setItem(row, col, table_item)
-
         self.result_table.resizeColumnsToContents()
-        self.result_table.setSortingEnabled(True)  # Re-enable sorting
-
-    def header_clicked(self, logical_index):
-        header = self.result_table.horizontalHeader()
-        order = Qt.SortOrder.AscendingOrder if header.sortIndicatorSection() != logical_index or header.sortIndicatorOrder() == Qt.SortOrder.DescendingOrder else Qt.SortOrder.DescendingOrder
-        self.result_table.sortItems(logical_index, order)
-
-        # Update header colors
-        for i in range(self.result_table.columnCount()):
-            if i == logical_index:
-                self.result_table.horizontalHeaderItem(i).setBackground(QColor(200, 200, 255))
-            else:
-                self.result_table.horizontalHeaderItem(i).setBackground(QColor(240, 240, 240))
 
     def print_all_watches(self):
-        results = get_all_watches(self.db_connection)
-        stats = get_watch_statistics(self.db_connection)
-        self.display_results(results, stats)
+        with self.database.reader() as conn:
+            stats = get_price_statistics(conn)
+        self.display_results({}, stats)
 
     def clear_database(self):
         reply = QMessageBox.question(self, 'Clear Database', 'Are you sure you want to clear the entire database?',
                                      QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No, QMessageBox.StandardButton.No)
         if reply == QMessageBox.StandardButton.Yes:
-            clear_database(self.db_connection)
-            self.result_table.setRowCount(0)
+            self.database.write(clear_database)
+            self.result_model.clear()
             self.stats_label.setText("Database cleared.")
             self.populate_dropdowns()  # Refresh dropdowns after clearing
 
@@ -208,6 +237,54 @@ class WatchDatabaseGUI(QMainWindow):
                                      QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No, QMessageBox.StandardButton.No)
         if reply == QMessageBox.StandardButton.Yes:
             self.stats_label.setText("Performing initial scrape... This may take a while.")
-            self.initial_scrape_function(self.db_connection)
-            self.stats_label.setText("Initial scrape completed.")
-            self.populate_dropdowns()  # Refresh dropdowns after scraping
\ No newline at end of file
+            self.scrape_worker = ScrapeWorker(self.database, self.initial_scrape_function, self)
+            self.scrape_worker.progress.connect(self.show_scrape_progress)
+            self.scrape_worker.failed.connect(self.scrape_failed)
+            self.scrape_worker.finished.connect(self.scrape_finished)
+            self.set_scraping(True)
+            self.scrape_worker.start()
+
+    def cancel_scrape(self):
+        if self.scrape_worker is not None:
+            self.scrape_worker.cancel()
+            self.cancel_scrape_button.setEnabled(False)
+            self.stats_label.setText("Cancelling scrape after the current listing...")
+
+    def set_scraping(self, scraping):
+        self.initial_scrape_button.setEnabled(not scraping)
+        self.clear_button.setEnabled(not scraping)
+        self.cancel_scrape_button.setEnabled(scraping)
+
+    def show_scrape_progress(self, event):
+        if event['stage'] == 'brand_start':
+            text = f"Scraping {event['brand']} ({event['brand_index']}/{event['brand_count']})..."
+        elif event['stage'] == 'page':
+            text = (f"Scraping {event['brand']}: page {event['page']}/{event['max_pages'] or '?'} complete. "
+                    f"New: {event['total_new']}, Updated: {event['total_updated']}, "
+                    f"{event['items_per_second']:.1f} items/sec")
+        else:
+            text = (f"Completed {event['brand']} ({event['brand_index']}/{event['brand_count']}). "
+                    f"Added {event['new']} new items, updated {event['updated']} items")
+        self.stats_label.setText(text)
+
+    def scrape_failed(self, message):
+        QMessageBox.warning(self, 'Initial Scrape', f"Scrape failed: {message}")
+
+    def scrape_finished(self):
+        cancelled = self.scrape_worker.cancel_event.is_set()
+        busy = self.scrape_worker.busy
+        self.scrape_worker = None
+        self.set_scraping(False)
+        if busy:
+            self.stats_label.setText("Another scrape is already running.")
+            QMessageBox.information(self, 'Initial Scrape', "Another scrape (e.g. the scheduled one) is already running. "
+                                    "Try again once it has finished.")
+            return
+        self.stats_label.setText("Initial scrape cancelled." if cancelled else "Initial scrape completed.")
+        self.populate_dropdowns()  # Refresh dropdowns after scraping
+
+    def closeEvent(self, event):
+        if self.scrape_worker is not None:
+            self.scrape_worker.cancel()
+            self.scrape_worker.wait()
+        super().closeEvent(event)
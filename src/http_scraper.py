@@ -0,0 +1,148 @@
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+import requests
+from requests.adapters import HTTPAdapter
+from parsing import parse_html, extract_watch_data, choose_condition
+from database import get_known_prices
+from metrics import metrics
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'en-GB,en;q=0.9',
+}
+# Statuses the site answers bots with; the browser fallback usually gets through
+BLOCKING_STATUSES = {403, 429, 503}
+
+
+class HttpFetcher:
+    def __init__(self, pool_size=10, timeout=15, retries=2):
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(DEFAULT_HEADERS)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @metrics.timed('http_fetch')
+    def fetch(self, url):
+        response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        return response.text
+
+    def close(self):
+        self.session.close()
+
+
+class FixtureFetcher:
+    # Serves canned HTML keyed by URL so the HTTP engine can run offline.
+    def __init__(self, pages):
+        self.pages = dict(pages)
+
+    def fetch(self, url):
+        if url not in self.pages:
+            raise KeyError(f"No fixture for {url}")
+        return self.pages[url]
+
+    def close(self):
+        pass
+
+
+class HostRateLimiter:
+    # Spaces requests to the same host at least 1/requests_per_second apart, across threads.
+    def __init__(self, requests_per_second):
+        self.interval = 1.0 / requests_per_second
+        self.lock = threading.Lock()
+        self.next_slot = {}
+
+    def wait(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class RateLimitedFetcher:
+    def __init__(self, fetcher, limiter):
+        self.fetcher = fetcher
+        self.limiter = limiter
+
+    def fetch(self, url):
+        self.limiter.wait(url)
+        return self.fetcher.fetch(url)
+
+    def close(self):
+        self.fetcher.close()
+
+
+def fetch_parsed(url, fetcher, fallback_fetcher, is_complete):
+    # The browser fallback renders pages the plain request couldn't: incomplete ones,
+    # and ones the site refused with a blocking status
+    try:
+        page = fetch_page(url, fetcher)
+        if is_complete(page) or fallback_fetcher is None:
+            return page
+        print(f"Falling back to browser rendering for {url}")
+    except requests.HTTPError as e:
+        if fallback_fetcher is None or not is_blocked(e):
+            raise
+        print(f"Got HTTP {e.response.status_code} for {url}; falling back to browser rendering")
+    metrics.increment('browser_fallbacks')
+    return fetch_page(url, fallback_fetcher)
+
+
+def fetch_page(url, fetcher):
+    text = fetcher.fetch(url)
+    with metrics.timer('parse'):
+        return parse_html(text, url)
+
+
+def is_blocked(error):
+    return error.response is not None and error.response.status_code in BLOCKING_STATUSES
+
+
+def changed_listing_links(conn, listing):
+    # Links whose product is unknown or whose card price differs from the one last seen.
+    # Cards without a readable price or currency are always re-fetched.
+    product_ids = [card['product_id'] for card in listing.article_cards if card['product_id']]
+    known_prices = get_known_prices(conn, product_ids)
+
+    links = []
+    for card in listing.article_cards:
+        product_id = card['product_id']
+        if product_id in known_prices and prices_match(known_prices[product_id], card):
+            continue
+        links.append(card['href'])
+    return links
+
+
+def prices_match(known_price, card):
+    # known_price is (price, currency, card_price, card_currency). Cards show the site's display
+    # currency, which need not be the listing's own, so a card is compared with the last card
+    # seen for the product. Without one only a card in the listing's currency can match its price.
+    price, currency, card_price, card_currency = known_price
+    if card['price'] is None or card['currency'] is None:
+        return False
+    if card_currency is not None:
+        return card['currency'] == card_currency and abs(card_price - card['price']) < 0.005
+    try:
+        return card['currency'] == currency and abs(float(price) - card['price']) < 0.005
+    except (ValueError, TypeError):
+        return False
+
+
+def scrape_detail(href, fetcher, fallback_fetcher=None):
+    detail = fetch_parsed(href, fetcher, fallback_fetcher, lambda page: page.graph_nodes()[1])
+    breadcrumb_list, product_data = detail.graph_nodes()
+    if not (breadcrumb_list and product_data):
+        return None
+    return extract_watch_data(breadcrumb_list, product_data, choose_condition(product_data, detail) or 'N/A')
+
+
+def page_number(url):
+    return int(parse_qs(urlparse(url).query).get('page', ['1'])[0])
@@ -0,0 +1,169 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PREFIX = 'watch_scraper'
+
+
+def label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def format_labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, fraction):
+        # Upper bound of the bucket holding the fraction-th observation (max for the overflow bucket)
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Metrics:
+    # Process-wide stage latencies and counters, shared by the scraper threads.
+    # Stage timings are histograms in seconds; counters are keyed by name + labels.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.monotonic()
+            self.histograms = {}
+            self.counters = {}
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def error(self, stage, exception):
+        self.increment('errors', stage=stage, type=type(exception).__name__)
+
+    @contextmanager
+    def timer(self, stage):
+        # Times the block, failed or not. Failures are counted with error() by whoever handles
+        # them, so each one is counted once, against the job that failed.
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.monotonic() - start)
+
+    def timed(self, stage):
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(stage):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def counter(self, name, **labels):
+        with self.lock:
+            return self.counters.get((name, label_key(labels)), 0)
+
+    def snapshot(self):
+        with self.lock:
+            elapsed = time.monotonic() - self.started
+            items = sum(value for (name, _), value in self.counters.items() if name == 'items')
+            return {
+                'timestamp': time.time(),
+                'elapsed': elapsed,
+                'items_per_second': items / elapsed if elapsed > 0 else 0.0,
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in sorted(self.counters.items())],
+                'stages': {stage: {'count': h.count, 'sum': h.sum, 'max': h.max,
+                                   'p50': h.quantile(0.5), 'p95': h.quantile(0.95),
+                                   'buckets': dict(zip([*map(str, h.buckets), '+Inf'], h.counts))}
+                           for stage, h in sorted(self.histograms.items())},
+            }
+
+    def summary(self):
+        snapshot = self.snapshot()
+        lines = [f"Elapsed {snapshot['elapsed']:.1f}s, {snapshot['items_per_second']:.2f} items/sec"]
+        for stage, stats in snapshot['stages'].items():
+            mean = stats['sum'] / stats['count'] if stats['count'] else 0.0
+            lines.append(f"{stage}: {stats['count']} calls, mean {mean * 1000:.0f}ms, "
+                         f"p50 <= {stats['p50'] * 1000:.0f}ms, p95 <= {stats['p95'] * 1000:.0f}ms, "
+                         f"max {stats['max'] * 1000:.0f}ms")
+        for counter in snapshot['counters']:
+            labels = ', '.join(f"{name}={value}" for name, value in counter['labels'].items())
+            lines.append(f"{counter['name']}{f' ({labels})' if labels else ''}: {counter['value']}")
+        return "\n".join(lines)
+
+    def prometheus_text(self):
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+            elapsed = time.monotonic() - self.started
+
+        lines = [f"# TYPE {PREFIX}_stage_seconds histogram"]
+        for stage, h in histograms:
+            labels = (('stage', stage),)
+            cumulative = 0
+            for bound, count in zip([*map(str, h.buckets), '+Inf'], h.counts):
+                cumulative += count
+                lines.append(f"{PREFIX}_stage_seconds_bucket{format_labels(labels, le=bound)} {cumulative}")
+            lines.append(f"{PREFIX}_stage_seconds_sum{format_labels(labels)} {h.sum}")
+            lines.append(f"{PREFIX}_stage_seconds_count{format_labels(labels)} {h.count}")
+
+        for name in sorted({name for (name, _), _ in counters}):
+            lines.append(f"# TYPE {PREFIX}_{name}_total counter")
+            for (counter_name, labels), value in counters:
+                if counter_name == name:
+                    lines.append(f"{PREFIX}_{name}_total{format_labels(labels)} {value}")
+
+        lines.append(f"# TYPE {PREFIX}_run_seconds gauge")
+        lines.append(f"{PREFIX}_run_seconds {elapsed}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path):
+        # *.jsonl appends one snapshot per run; anything else is rewritten as a Prometheus text file
+        if path.endswith('.jsonl'):
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(self.snapshot()) + "\n")
+        else:
+            temp_path = f"{path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(self.prometheus_text())
+            os.replace(temp_path, path)
+
+
+metrics = Metrics()
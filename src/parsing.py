@@ -0,0 +1,280 @@
+import json
+import math
+import re
+import threading
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+ARTICLE_LINK_CLASSES = {'js-article-item', 'article-item', 'block-item', 'rcard'}
+CONDITION_BUTTON_CLASSES = {'link', 'js-conditions'}
+ARTICLE_ID_PATTERN = re.compile(r'--id(\d+)\.htm')
+PRICE_PATTERN = re.compile(r'\d[\d,]*(?:\.\d+)?')
+CURRENCY_CODE_PATTERN = re.compile(r'\b[A-Z]{3}\b')
+CURRENCY_CODES = {'GBP', 'EUR', 'USD', 'CHF', 'HKD', 'SGD', 'AUD', 'CAD', 'JPY'}
+# Checked in order, so the prefixed dollars come before a bare $
+CURRENCY_SYMBOLS = [('US$', 'USD'), ('HK$', 'HKD'), ('CA$', 'CAD'), ('C$', 'CAD'), ('A$', 'AUD'), ('S$', 'SGD'),
+                    ('$', 'USD'), ('£', 'GBP'), ('€', 'EUR'), ('¥', 'JPY')]
+COUNT_PATTERN = re.compile(r'\d[\d,.]*')
+RESULT_COUNT_CLASSES = ('result-count', 'total-count')
+CONDITION_SELECTORS = ['button.link.js-conditions', '.article-condition span']
+JSON_LD_CONDITION = 'json-ld itemCondition'
+ITEM_CONDITIONS = {
+    'NewCondition': 'New',
+    'UsedCondition': 'Used',
+    'RefurbishedCondition': 'Refurbished',
+    'DamagedCondition': 'Damaged',
+}
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'}
+
+
+class ChronoPageParser(HTMLParser):
+    # Pulls out the same things the Selenium scraper reads from a rendered page:
+    # article links (plus each card's product ID, price and currency), JSON-LD blocks and the condition text.
+    # Listing pages also report their pagination: the next-page link and the total result count.
+    def __init__(self, base_url=''):
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.article_links = []
+        self.article_cards = []
+        self.json_ld_blocks = []
+        self.condition_button = None
+        self.condition_span = None
+        self.next_page_url = None
+        self.result_count = None
+        self.has_pagination = False
+        self._stack = []
+        self._json_ld_buffer = None
+        self._capture = None
+        self._capture_buffer = []
+        self._card = None
+        self._card_price_tag = None
+        self._card_price_buffer = []
+        self._count_tag = None
+        self._count_buffer = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        classes = set((attrs.get('class') or '').split())
+
+        if tag == 'a' and ARTICLE_LINK_CLASSES <= classes and attrs.get('href'):
+            href = urljoin(self.base_url, attrs['href'])
+            if href not in self.article_links:
+                self.article_links.append(href)
+                self._card = {'href': href, 'product_id': attrs.get('data-article-id') or parse_article_id(href),
+                              'price': None, 'currency': None}
+                self.article_cards.append(self._card)
+        elif self._card is not None and self._card_price_tag is None and self._card['price'] is None \
+                and any('price' in name for name in classes):
+            self._card_price_tag = tag
+            self._card_price_buffer = []
+        elif tag in ('a', 'link') and attrs.get('href') and self.next_page_url is None \
+                and ('next' in (attrs.get('rel') or '').split() or 'paging-next' in classes):
+            self.next_page_url = urljoin(self.base_url, attrs['href'])
+        elif tag == 'script' and attrs.get('type') == 'application/ld+json':
+            self._json_ld_buffer = []
+        elif self._capture is None:
+            if tag == 'button' and CONDITION_BUTTON_CLASSES <= classes and self.condition_button is None:
+                self._start_capture('button')
+            elif tag == 'span' and self.condition_span is None and self._inside_class('article-condition'):
+                self._start_capture('span')
+
+        if 'pagination' in classes:
+            self.has_pagination = True
+        if self.result_count is None and self._count_tag is None \
+                and any(marker in name for name in classes for marker in RESULT_COUNT_CLASSES):
+            self._count_tag = tag
+            self._count_buffer = []
+
+        if tag not in VOID_TAGS:
+            self._stack.append((tag, classes))
+
+    def handle_endtag(self, tag):
+        if tag == self._card_price_tag:
+            text = ''.join(self._card_price_buffer)
+            self._card['price'] = parse_card_price(text)
+            self._card['currency'] = parse_card_currency(text)
+            self._card_price_tag = None
+        if tag == 'a':
+            self._card = None
+            self._card_price_tag = None
+        if tag == self._count_tag:
+            self.result_count = parse_count(''.join(self._count_buffer))
+            self._count_tag = None
+
+        if tag == 'script' and self._json_ld_buffer is not None:
+            self.json_ld_blocks.append(''.join(self._json_ld_buffer))
+            self._json_ld_buffer = None
+        elif tag == self._capture:
+            text = ' '.join(''.join(self._capture_buffer).split())
+            if tag == 'button':
+                self.condition_button = text
+            else:
+                self.condition_span = text
+            self._capture = None
+
+        for index in range(len(self._stack) - 1, -1, -1):
+            if self._stack[index][0] == tag:
+                del self._stack[index:]
+                break
+
+    def handle_data(self, data):
+        if self._json_ld_buffer is not None:
+            self._json_ld_buffer.append(data)
+        elif self._capture is not None:
+            self._capture_buffer.append(data)
+        if self._card_price_tag is not None:
+            self._card_price_buffer.append(data)
+        if self._count_tag is not None:
+            self._count_buffer.append(data)
+
+    def _start_capture(self, tag):
+        self._capture = tag
+        self._capture_buffer = []
+
+    def _inside_class(self, class_name):
+        return any(class_name in classes for _, classes in self._stack)
+
+    @property
+    def condition(self):
+        return self.condition_button or self.condition_span or None
+
+    def graph_nodes(self):
+        return find_graph_nodes(self.json_ld_blocks)
+
+    def page_count(self, page_size=None):
+        # Listing pages implied by the result count, or None when the page doesn't show one
+        page_size = page_size or len(self.article_links)
+        if self.result_count is None or not page_size:
+            return None
+        return math.ceil(self.result_count / page_size)
+
+    def has_next_page(self, page, page_size=None):
+        # A next-page link wins; a pagination bar without one marks the last page. Otherwise
+        # use the result count, and failing that keep going while pages are full: with the
+        # page_size of an earlier full page known, a shorter page is the last one.
+        if self.next_page_url:
+            return True
+        if self.has_pagination:
+            return False
+        page_count = self.page_count(page_size)
+        if page_count is not None:
+            return page < page_count
+        if page_size:
+            return len(self.article_links) >= page_size
+        return bool(self.article_links)
+
+
+class SelectorStats:
+    # Hit/miss counts per condition source so we can see which extraction path pages use
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def record(self, source, hit):
+        with self.lock:
+            counts = self.counts.setdefault(source, [0, 0])
+            counts[0 if hit else 1] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {source: tuple(counts) for source, counts in self.counts.items()}
+
+    def summary(self):
+        lines = []
+        for source, (hits, misses) in sorted(self.snapshot().items()):
+            lines.append(f"{source}: {hits} hits, {misses} misses")
+        return "\n".join(lines)
+
+
+condition_stats = SelectorStats()
+
+
+def parse_html(html, base_url=''):
+    parser = ChronoPageParser(base_url)
+    parser.feed(html)
+    parser.close()
+    return parser
+
+
+def parse_article_id(href):
+    match = ARTICLE_ID_PATTERN.search(href)
+    return match.group(1) if match else None
+
+
+def parse_card_price(text):
+    # "£12,345" -> 12345.0; "Price on request" -> None
+    match = PRICE_PATTERN.search(text)
+    if not match:
+        return None
+    return float(match.group().replace(',', ''))
+
+
+def parse_card_currency(text):
+    # "£12,345" -> 'GBP', "CHF 9,800" -> 'CHF'; None if the card shows no currency
+    match = CURRENCY_CODE_PATTERN.search(text)
+    if match and match.group() in CURRENCY_CODES:
+        return match.group()
+    return next((code for symbol, code in CURRENCY_SYMBOLS if symbol in text), None)
+
+
+def parse_count(text):
+    # "1,234 listings" -> 1234
+    match = COUNT_PATTERN.search(text)
+    if not match:
+        return None
+    return int(match.group().replace(',', '').replace('.', ''))
+
+
+def find_graph_nodes(json_ld_blocks):
+    for block in json_ld_blocks:
+        try:
+            json_data = json.loads(block)
+        except ValueError:
+            continue
+        if not isinstance(json_data, dict):
+            continue
+
+        graph = json_data.get('@graph', [])
+        breadcrumb_list = next((item for item in graph if item.get('@type') == 'BreadcrumbList'), None)
+        product_data = next((item for item in graph if item.get('@type') == 'Product'), None)
+        if breadcrumb_list and product_data:
+            return breadcrumb_list, product_data
+
+    return None, None
+
+
+def json_ld_condition(product_data):
+    # schema.org itemCondition, e.g. "https://schema.org/UsedCondition" -> "Used"
+    offers = product_data.get('offers', {})
+    value = product_data.get('itemCondition') or (offers.get('itemCondition') if isinstance(offers, dict) else None)
+    if not value:
+        return None
+    name = str(value).rstrip('/').rsplit('/', 1)[-1]
+    return ITEM_CONDITIONS.get(name, name)
+
+
+def choose_condition(product_data, page=None):
+    # The condition button, then the .article-condition span, and only when the page shows
+    # neither the coarser JSON-LD itemCondition. Only the sources tried are counted.
+    if page is not None:
+        for selector, text in zip(CONDITION_SELECTORS, (page.condition_button, page.condition_span)):
+            condition_stats.record(selector, bool(text))
+            if text:
+                return text
+
+    condition = json_ld_condition(product_data)
+    condition_stats.record(JSON_LD_CONDITION, condition is not None)
+    return condition
+
+
+def extract_watch_data(breadcrumb_list, product_data, condition='N/A'):
+    product_id = product_data.get('productID', 'N/A')
+    brand = product_data.get('brand', 'N/A')
+    model = next((item['item']['name'] for item in breadcrumb_list['itemListElement']
+                  if item['position'] == 3), 'N/A').replace(' watches', '')
+    ref = product_data.get('sku', 'N/A')
+    price = product_data.get('offers', {}).get('price', 'N/A')
+    currency = product_data.get('offers', {}).get('priceCurrency', 'N/A')
+    year = product_data.get('productionDate', 'N/A')
+
+    return [product_id, brand, model, ref, price, currency, condition, year]
@@ -0,0 +1,88 @@
+import functools
+import threading
+from collections import OrderedDict
+import database
+from database import FILTER_DEFAULTS, get_data_version, get_database_path, normalize_ref
+from metrics import metrics
+
+CACHE_SIZE = 64
+MISSING = object()
+
+
+def filter_key(filters):
+    # Filters that select the same rows give the same key: empty values and "All ..." entries
+    # are dropped, search text is trimmed and refs are reduced to their key
+    key = []
+    for name, value in filters.items():
+        if isinstance(value, str):
+            value = value.strip()
+            if name == 'ref':
+                value = normalize_ref(value) or value
+        elif isinstance(value, list):
+            value = tuple(value)
+        if value is None or value == '' or value is False or value == FILTER_DEFAULTS.get(name):
+            continue
+        key.append((name, value))
+    return tuple(sorted(key))
+
+
+class ResultCache:
+    # Least recently used query results, each stored with the data_version it was read at.
+    # Triggers bump the version on every change to watches, so after an ingest or
+    # clear_database the next lookup misses and the query runs again.
+    def __init__(self, size=CACHE_SIZE, name='results'):
+        self.size = size
+        self.name = name
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key, version):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != version:
+                metrics.increment('query_cache_lookups', cache=self.name, result='miss')
+                return MISSING
+            self.entries.move_to_end(key)
+        metrics.increment('query_cache_lookups', cache=self.name, result='hit')
+        return entry[1]
+
+    def put(self, key, version, result):
+        with self.lock:
+            self.entries[key] = (version, result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def cached(cache):
+    # Memoizes func(conn, *args, **filters) in cache, per database file. Results are shared
+    # between callers, so they must not be modified. The version is read before the query,
+    # so a write that lands in between only costs a miss on the next call.
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(conn, *args, **kwargs):
+            key = (get_database_path(conn), func.__name__, args, filter_key(kwargs))
+            version = get_data_version(conn)
+            result = cache.get(key, version)
+            if result is MISSING:
+                result = func(conn, *args, **kwargs)
+                cache.put(key, version, result)
+            return result
+        return wrapper
+    return decorator
+
+
+results = ResultCache()
+
+# Cached versions of the queries the GUI repeats as the filters are toggled
+count_watches = cached(results)(database.count_watches)
+query_watches = cached(results)(database.query_watches)
+query_watches_page = cached(results)(database.query_watches_page)
+get_watch_statistics = cached(results)(database.get_watch_statistics)
+get_price_statistics = cached(results)(database.get_price_statistics)
+get_filtered_values = cached(results)(database.get_filtered_values)
+get_facet_counts = cached(results)(database.get_facet_counts)
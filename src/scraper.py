@@ -2,115 +2,314 @@ from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, NoSuchElementException
+from selenium.common.exceptions import TimeoutException, WebDriverException
 from selenium.webdriver.chrome.service import Service
 from webdriver_manager.chrome import ChromeDriverManager
-import json
-from database import insert_watch, check_watch_exists, update_watch, test_watch_data
+from database import upsert_watches, save_listing_cards, test_watch_data
+from parsing import find_graph_nodes, extract_watch_data, parse_html, json_ld_condition, condition_stats, CONDITION_SELECTORS, JSON_LD_CONDITION
+from http_scraper import changed_listing_links, page_number
+from crawl import crawl
+from metrics import metrics
+import threading
+import queue
+import time
 
+_chromedriver_path = None
+_chromedriver_lock = threading.Lock()
+
+def get_chromedriver_path():
+    # ChromeDriverManager().install() checks the cache/network on every call, so resolve it once per process
+    global _chromedriver_path
+    with _chromedriver_lock:
+        if _chromedriver_path is None:
+            _chromedriver_path = ChromeDriverManager().install()
+        return _chromedriver_path
+
+class AdaptiveTimeout:
+    # Wait timeout that follows observed latency: factor x the moving average of
+    # successful waits, clamped to [minimum, maximum]. Uses `initial` until it has samples.
+    def __init__(self, initial, minimum, maximum, factor=3.0, smoothing=0.2, min_samples=3):
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.factor = factor
+        self.smoothing = smoothing
+        self.min_samples = min_samples
+        self.average = None
+        self.samples = 0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self.lock:
+            self.average = seconds if self.average is None else self.average + self.smoothing * (seconds - self.average)
+            self.samples += 1
+
+    def current(self):
+        with self.lock:
+            if self.samples < self.min_samples:
+                return self.initial
+            return min(self.maximum, max(self.minimum, self.factor * self.average))
+
+json_ld_timeout = AdaptiveTimeout(initial=10, minimum=2, maximum=10)
+condition_timeout = AdaptiveTimeout(initial=10, minimum=2, maximum=20)
+
+def wait_for_json_ld(driver):
+    start = time.monotonic()
+    with metrics.timer('json_ld_wait'):
+        script_tag = WebDriverWait(driver, json_ld_timeout.current()).until(
+            EC.presence_of_element_located((By.CSS_SELECTOR, 'script[type="application/ld+json"]'))
+        )
+    json_ld_timeout.observe(time.monotonic() - start)
+    return script_tag
+
+def find_condition(driver, product_data):
+    # The page's condition text, from one wait that polls every known selector, falling back to
+    # the coarser JSON-LD itemCondition. With a fallback at hand the page is polled once rather
+    # than waited on. Only the selectors actually evaluated are counted.
+    fallback = json_ld_condition(product_data)
+
+    def first_match(driver):
+        for selector in CONDITION_SELECTORS:
+            elements = driver.find_elements(By.CSS_SELECTOR, selector)
+            if elements:
+                return selector, elements[0]
+        return False
+
+    start = time.monotonic()
+    try:
+        selector, element = WebDriverWait(driver, 0 if fallback is not None else condition_timeout.current()).until(first_match)
+    except TimeoutException:
+        metrics.observe('condition_wait', time.monotonic() - start)
+        for selector in CONDITION_SELECTORS:
+            condition_stats.record(selector, False)
+        condition_stats.record(JSON_LD_CONDITION, fallback is not None)
+        return fallback
+
+    metrics.observe('condition_wait', time.monotonic() - start)
+    if fallback is None:
+        condition_timeout.observe(time.monotonic() - start)
+    # first_match stopped at selector, so the ones after it were never evaluated
+    text = element.text.strip()
+    for other in CONDITION_SELECTORS[:CONDITION_SELECTORS.index(selector) + 1]:
+        condition_stats.record(other, other == selector and bool(text))
+    if text:
+        return text
+    condition_stats.record(JSON_LD_CONDITION, fallback is not None)
+    return fallback
+
+@metrics.timed('driver_start')
 def setup_driver():
     chrome_options = webdriver.ChromeOptions()
     chrome_options.add_argument("--headless")
-    service = Service(ChromeDriverManager().install())
+    service = Service(get_chromedriver_path())
     return webdriver.Chrome(service=service, options=chrome_options)
 
-def parse_page(url, conn):
-    driver = setup_driver()
+class DriverPool:
+    # Keeps up to `size` Chrome sessions alive across pages. Sessions are created on
+    # first use and replaced after max_pages_per_driver pages or when they stop responding.
+    def __init__(self, size=1, max_pages_per_driver=50):
+        self.size = size
+        self.max_pages_per_driver = max_pages_per_driver
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+        self.created = 0
+        self.page_counts = {}
+
+    def acquire(self):
+        while True:
+            try:
+                return self.idle.get_nowait()
+            except queue.Empty:
+                pass
+
+            with self.lock:
+                can_create = self.created < self.size
+                if can_create:
+                    self.created += 1
+
+            if can_create:
+                try:
+                    driver = setup_driver()
+                except Exception:
+                    with self.lock:
+                        self.created -= 1
+                    raise
+                with self.lock:
+                    self.page_counts[driver] = 0
+                return driver
+
+            try:
+                return self.idle.get(timeout=0.5)
+            except queue.Empty:
+                pass
+
+    def release(self, driver):
+        with self.lock:
+            self.page_counts[driver] += 1
+            worn_out = self.page_counts[driver] >= self.max_pages_per_driver
+
+        if worn_out or not self._is_alive(driver):
+            self.discard(driver)
+        else:
+            self.idle.put(driver)
+
+    def discard(self, driver):
+        with self.lock:
+            self.page_counts.pop(driver, None)
+            self.created -= 1
+        try:
+            driver.quit()
+        except WebDriverException:
+            pass
+
+    def close(self):
+        while True:
+            try:
+                driver = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(driver)
+
+    @staticmethod
+    def _is_alive(driver):
+        try:
+            # Drop any tabs left open by an interrupted page before handing the session back
+            handles = driver.window_handles
+            for handle in handles[1:]:
+                driver.switch_to.window(handle)
+                driver.close()
+            driver.switch_to.window(handles[0])
+            return True
+        except WebDriverException:
+            return False
+
+class SeleniumFetcher:
+    # Renders pages in headless Chrome for the HTTP engine when the raw HTML lacks the data.
+    def __init__(self, driver_pool):
+        self.driver_pool = driver_pool
+
+    def fetch(self, url):
+        driver = self.driver_pool.acquire()
+        try:
+            metrics.increment('browser_fetches')
+            with metrics.timer('page_load'):
+                driver.get(url)
+            try:
+                WebDriverWait(driver, 10).until(
+                    EC.presence_of_element_located((By.CSS_SELECTOR, 'script[type="application/ld+json"], a.js-article-item'))
+                )
+            except TimeoutException:
+                print(f"Timeout waiting for content on {url}")
+            return driver.page_source
+        finally:
+            self.driver_pool.release(driver)
+
+    def close(self):
+        pass
+
+def parse_page(url, conn, driver_pool=None, incremental=False, cancel_event=None, page_size=None):
+    # Scrapes one listing page and its detail pages in Chrome. Only new or re-priced listings
+    # are opened when incremental; page_size is the listing count of a full page, if known.
+    # Returns (new, updated, total, has_next_page, listing_count).
+    owns_pool = driver_pool is None
+    if owns_pool:
+        driver_pool = DriverPool()
+    driver = None
     new_items_count = 0
     updated_items_count = 0
     total_items_count = 0
+    has_next_page = False
+    listing_count = 0
+    rows = []
+    scraped = []
 
     try:
+        driver = driver_pool.acquire()
         print(f"Processing page: {url}")
-        driver.get(url)
+        with metrics.timer('page_load'):
+            driver.get(url)
         
         links = driver.find_elements(By.CSS_SELECTOR, 'a.js-article-item.article-item.block-item.rcard')
+        hrefs = [link.get_attribute('href') for link in links]
+        listing = parse_html(driver.page_source, url)
+        has_next_page = listing.has_next_page(page_number(url), page_size)
+        listing_count = len(listing.article_links)
+        if incremental:
+            changed = set(changed_listing_links(conn, listing))
+            print(f"Skipping {len([href for href in hrefs if href not in changed])} unchanged listings")
+            hrefs = [href for href in hrefs if href in changed]
         
-        for link in links:
-            href = link.get_attribute('href')
+        for href in hrefs:
+            if cancel_event is not None and cancel_event.is_set():
+                break
+
             print(f"Processing link: {href}")
             
             driver.execute_script("window.open('');")
             driver.switch_to.window(driver.window_handles[-1])
-            driver.get(href)
             
             try:
-                script_tag = WebDriverWait(driver, 10).until(
-                    EC.presence_of_element_located((By.CSS_SELECTOR, 'script[type="application/ld+json"]'))
-                )
-                json_data = json.loads(script_tag.get_attribute('innerHTML'))
-                
-                breadcrumb_list = next((item for item in json_data['@graph'] if item['@type'] == 'BreadcrumbList'), None)
-                product_data = next((item for item in json_data['@graph'] if item['@type'] == 'Product'), None)
+                with metrics.timer('page_load'):
+                    driver.get(href)
+                script_tag = wait_for_json_ld(driver)
+                breadcrumb_list, product_data = find_graph_nodes([script_tag.get_attribute('innerHTML')])
                 
                 if breadcrumb_list and product_data:
-                    product_id = product_data.get('productID', 'N/A')
-                    
-                    brand = product_data.get('brand', 'N/A')
-                    model = next((item['item']['name'] for item in breadcrumb_list['itemListElement'] 
-                                  if item['position'] == 3), 'N/A').replace(' watches', '')
-                    ref = product_data.get('sku', 'N/A')
-                    price = product_data.get('offers', {}).get('price', 'N/A')
-                    currency = product_data.get('offers', {}).get('priceCurrency', 'N/A')
-                    year = product_data.get('productionDate', 'N/A')
-                    
-                    condition = 'N/A'
-                    try:
-                        condition_element = WebDriverWait(driver, 20).until(
-                            EC.presence_of_element_located((By.CSS_SELECTOR, "button.link.js-conditions"))
-                        )
-                        condition = condition_element.text.strip()
-                    except TimeoutException:
-                        print(f"Timeout waiting for condition button on {href}")
-                        try:
-                            condition_element = driver.find_element(By.CSS_SELECTOR, ".article-condition span")
-                            condition = condition_element.text.strip()
-                        except NoSuchElementException:
-                            print(f"Could not find condition element on {href}")
-                    
-                    watch_data = [product_id, brand, model, ref, price, currency, condition, year]
-                    
-                    if check_watch_exists(conn, product_id):
-                        update_watch(conn, watch_data)
-                        updated_items_count += 1
-                        print(f"Updated existing watch: {product_id}")
-                    else:
-                        insert_watch(conn, watch_data)
-                        new_items_count += 1
-                        print(f"Added new watch: {product_id}")
+                    condition = find_condition(driver, product_data)
+                    if condition is None:
+                        print(f"Could not find condition element on {href}")
+                        condition = 'N/A'
                     
-                    total_items_count += 1
+                    rows.append(extract_watch_data(breadcrumb_list, product_data, condition))
+                    scraped.append(href)
             
             except Exception as e:
                 print(f"Error processing {href}: {str(e)}")
+                metrics.error('detail', e)
             
             finally:
                 driver.close()
                 driver.switch_to.window(driver.window_handles[0])
+
+        if rows:
+            new_items_count, updated_items_count = upsert_watches(conn, rows)
+            total_items_count = new_items_count + updated_items_count
+            save_listing_cards(conn, [card for card in listing.article_cards if card['href'] in scraped])
     
     except Exception as e:
         print(f"An error occurred during scraping: {str(e)}")
+        metrics.error('listing', e)
     
     finally:
-        driver.quit()
-
-    return new_items_count, updated_items_count, total_items_count
-
-def scrape_brand(brand, conn, url, max_pages=10):
-    total_new_items = 0
-    total_updated_items = 0
-    total_items = 0
-
-    for page in range(1, max_pages + 1):
-        page_url = f"{url}?page={page}"
-        new_items, updated_items, items = parse_page(page_url, conn)
-        total_new_items += new_items
-        total_updated_items += updated_items
-        total_items += items
+        if driver is not None:
+            driver_pool.release(driver)
+        if owns_pool:
+            driver_pool.close()
 
-        print(f"Page {page} complete. New: {new_items}, Updated: {updated_items}, Total: {items}")
+    return new_items_count, updated_items_count, total_items_count, has_next_page, listing_count
 
-    return total_new_items, total_updated_items, total_items
+def scrape_brand(brand, conn, url, max_pages=10, fetcher=None, workers=1, rate_limit=None, driver_pool=None,
+                 incremental=False, progress=None, cancel_event=None):
+    # Crawls one brand with the Crawler. With a fetcher the pages are read over HTTP and
+    # Chrome only renders the ones the fetcher couldn't; without one Chrome reads every page.
+    # Pass a driver_pool to share Chrome sessions across brands; otherwise one pool lives
+    # for this call. The other options are the Crawler's. Returns (new, updated, total).
+    owns_pool = driver_pool is None
+    if owns_pool:
+        driver_pool = DriverPool()
+    browser = SeleniumFetcher(driver_pool)
+    try:
+        if fetcher is None:
+            fetcher, fallback_fetcher = browser, None
+        else:
+            fallback_fetcher = browser
+        results = crawl(conn, {brand: url}, fetcher, fallback_fetcher, max_pages=max_pages, workers=workers,
+                        rate_limit=rate_limit, incremental=incremental, progress=progress, cancel_event=cancel_event)
+    finally:
+        browser.close()
+        if owns_pool:
+            driver_pool.close()
+    return results[brand]
 
 def test_first_watch(url):
     driver = setup_driver()
@@ -129,39 +328,16 @@ def test_first_watch(url):
         driver.get(href)
         
         # Extract data
-        script_tag = WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.CSS_SELECTOR, 'script[type="application/ld+json"]'))
-        )
-        json_data = json.loads(script_tag.get_attribute('innerHTML'))
-        
-        breadcrumb_list = next((item for item in json_data['@graph'] if item['@type'] == 'BreadcrumbList'), None)
-        product_data = next((item for item in json_data['@graph'] if item['@type'] == 'Product'), None)
+        script_tag = wait_for_json_ld(driver)
+        breadcrumb_list, product_data = find_graph_nodes([script_tag.get_attribute('innerHTML')])
         
         if breadcrumb_list and product_data:
-            product_id = product_data.get('productID', 'N/A')
-            brand = product_data.get('brand', 'N/A')
-            model = next((item['item']['name'] for item in breadcrumb_list['itemListElement'] 
-                          if item['position'] == 3), 'N/A').replace(' watches', '')
-            ref = product_data.get('sku', 'N/A')
-            price = product_data.get('offers', {}).get('price', 'N/A')
-            currency = product_data.get('offers', {}).get('priceCurrency', 'N/A')
-            year = product_data.get('productionDate', 'N/A')
-            
-            condition = 'N/A'
-            try:
-                condition_element = WebDriverWait(driver, 20).until(
-                    EC.presence_of_element_located((By.CSS_SELECTOR, "button.link.js-conditions"))
-                )
-                condition = condition_element.text.strip()
-            except TimeoutException:
-                print("Timeout waiting for condition button")
-                try:
-                    condition_element = driver.find_element(By.CSS_SELECTOR, ".article-condition span")
-                    condition = condition_element.text.strip()
-                except NoSuchElementException:
-                    print("Could not find condition element")
+            condition = find_condition(driver, product_data)
+            if condition is None:
+                print("Could not find condition element")
+                condition = 'N/A'
             
-            watch_data = [product_id, brand, model, ref, price, currency, condition, year]
+            watch_data = extract_watch_data(breadcrumb_list, product_data, condition)
             test_watch_data(watch_data)
         else:
             print("Could not extract watch data from JSON-LD")
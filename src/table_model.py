@@ -0,0 +1,135 @@
+from PyQt6.QtCore import Qt, QAbstractTableModel, QAbstractListModel, QModelIndex
+from PyQt6.QtGui import QColor
+from database import WATCH_COLUMNS, format_price
+from query_cache import count_watches, query_watches_page
+
+HEADERS = ["ID", "Brand", "Model", "Ref", "Price", "Currency", "Condition", "Year"]
+PRICE_COLUMN = WATCH_COLUMNS.index('price')
+NUMERIC_COLUMNS = {WATCH_COLUMNS.index('product_id'), PRICE_COLUMN, WATCH_COLUMNS.index('year')}
+
+class WatchTableModel(QAbstractTableModel):
+    # Loads query results from sqlite a page at a time as the view scrolls; sorting is done by the query.
+    # Each page is read on a connection borrowed from the ConnectionManager.
+    def __init__(self, database, page_size=500, parent=None):
+        super().__init__(parent)
+        self.database = database
+        self.page_size = page_size
+        self.filters = None
+        self.rows = []
+        self.total_rows = 0
+        self.sort_column = None
+        self.sort_order = Qt.SortOrder.AscendingOrder
+
+    def set_filters(self, filters):
+        self.filters = dict(filters)
+        self.reload()
+
+    def reload(self):
+        self.beginResetModel()
+        self.rows = []
+        with self.database.reader() as conn:
+            self.total_rows = count_watches(conn, **self.filters)
+        self.endResetModel()
+        self.fetchMore(QModelIndex())
+
+    def clear(self):
+        self.beginResetModel()
+        self.filters = None
+        self.rows = []
+        self.total_rows = 0
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(HEADERS)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and len(self.rows) < self.total_rows
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+
+        # Rows end with their rowid; the next page starts after the last row's sort value and rowid
+        after = None
+        if self.rows:
+            last = self.rows[-1]
+            after = (last[self.sort_column] if self.sort_column is not None else None, last[-1])
+        order_by = WATCH_COLUMNS[self.sort_column] if self.sort_column is not None else None
+        with self.database.reader() as conn:
+            page = query_watches_page(conn, self.page_size, after=after, order_by=order_by,
+                                      descending=self.sort_order == Qt.SortOrder.DescendingOrder, **self.filters)
+        if not page:
+            # The table shrank since the count was taken
+            self.total_rows = len(self.rows)
+            return
+
+        self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(page) - 1)
+        self.rows.extend(page)
+        self.endInsertRows()
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+
+        value = self.rows[index.row()][index.column()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            if index.column() == PRICE_COLUMN:
+                return format_price(value)
+            return None if value is None else str(value)
+        if role == Qt.ItemDataRole.EditRole:
+            return value
+        if role == Qt.ItemDataRole.TextAlignmentRole and index.column() in NUMERIC_COLUMNS:
+            return Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter
+        return None
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if orientation != Qt.Orientation.Horizontal:
+            return super().headerData(section, orientation, role)
+        if role == Qt.ItemDataRole.DisplayRole:
+            return HEADERS[section]
+        if role == Qt.ItemDataRole.BackgroundRole:
+            return QColor(200, 200, 255) if section == self.sort_column else QColor(240, 240, 240)
+        return None
+
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder):
+        self.sort_column = column if column >= 0 else None
+        self.sort_order = order
+        if self.filters is not None:
+            self.reload()
+
+class FacetListModel(QAbstractListModel):
+    # Dropdown entries for one filter column: an "All ..." row, then "label (count)" rows
+    # carrying the filter value as UserRole data. Rows are rendered on demand, so a column
+    # with hundreds of thousands of distinct values fills instantly.
+    def __init__(self, all_label, parent=None):
+        super().__init__(parent)
+        self.all_label = all_label
+        self.values = []
+
+    def set_values(self, values):
+        self.beginResetModel()
+        self.values = values
+        self.endResetModel()
+
+    def row_of(self, value):
+        if value is None:
+            return 0
+        return next((row for row, (item, _, _) in enumerate(self.values, start=1) if item == value), -1)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.values) + 1
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        if index.row() == 0:
+            return self.all_label if role == Qt.ItemDataRole.DisplayRole else None
+        value, count, label = self.values[index.row() - 1]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return f"{label} ({count})"
+        if role == Qt.ItemDataRole.UserRole:
+            return value
+        return None
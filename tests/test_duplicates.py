@@ -0,0 +1,44 @@
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from database import setup_database, upsert_watches, insert_watch, update_watch, refresh_duplicates
+
+
+def duplicate_marks(conn):
+    return dict(conn.execute("SELECT product_id, duplicate_of FROM watches"))
+
+
+def refreshed_marks(conn):
+    with conn:
+        refresh_duplicates(conn.cursor())
+    return duplicate_marks(conn)
+
+
+def test_reprice_matches_refresh(tmp_path):
+    conn = setup_database(str(tmp_path / 'watches.db'))
+    upsert_watches(conn, [(product_id, 'Rolex', 'Submariner', '126610LN', 5000, 'GBP', 'Good', '2020')
+                          for product_id in ('1', '2', '3')])
+    upsert_watches(conn, [('1', 'Rolex', 'Submariner', '126610LN', 5010, 'GBP', 'Good', '2020')])
+    marks = duplicate_marks(conn)
+    assert marks == {'1': None, '2': '1', '3': '1'}
+    assert marks == refreshed_marks(conn)
+
+
+def test_incremental_matches_refresh(tmp_path):
+    # Random writes that move listings between blocks and price bands
+    conn = setup_database(str(tmp_path / 'watches.db'))
+    rng = random.Random(0)
+    for _ in range(200):
+        rows = [(str(rng.randrange(40)), rng.choice(['Rolex', 'Omega']), 'Model', rng.choice(['A1', 'a-1', 'B2']),
+                 rng.choice([1000, 1010, 1020, 1040, 1060, None]), 'GBP', 'Good', rng.choice(['2020', '2021', None]))
+                for _ in range(rng.randrange(1, 6))]
+        write = rng.choice([upsert_watches, insert_watch, update_watch])
+        if write is upsert_watches:
+            write(conn, rows)
+        else:
+            write(conn, list(rows[0]))
+        marks = duplicate_marks(conn)
+        assert marks == refreshed_marks(conn), rows
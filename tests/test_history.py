@@ -0,0 +1,16 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from database import setup_database, upsert_watches, get_price_history
+
+
+def test_repriced_twice_without_delay(tmp_path):
+    # Observations are keyed by the millisecond; back-to-back changes must not fail the batch
+    conn = setup_database(str(tmp_path / 'watches.db'))
+    for price in (5000, 5100, 5200, 5300):
+        upsert_watches(conn, [('1', 'Rolex', 'Submariner', '126610LN', price, 'GBP', 'Good', '2020')])
+
+    assert conn.execute("SELECT price FROM watches").fetchone() == (5300,)
+    assert get_price_history(conn, '1')[-1][2] == 5300
@@ -0,0 +1,150 @@
+import json
+import os
+import sys
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from database import setup_database
+from fixture_server import FixtureCatalog
+from crawl import crawl
+from http_scraper import FixtureFetcher
+from parsing import parse_html, find_graph_nodes
+
+BASE_URL = 'https://www.chrono24.co.uk'
+
+
+class BlockedFetcher:
+    def __init__(self, status):
+        self.status = status
+        self.urls = []
+
+    def fetch(self, url):
+        self.urls.append(url)
+        response = requests.Response()
+        response.status_code = self.status
+        raise requests.HTTPError(f"{self.status} for {url}", response=response)
+
+
+class RecordingFetcher(FixtureFetcher):
+    def __init__(self, pages):
+        super().__init__(pages)
+        self.urls = []
+
+    def fetch(self, url):
+        self.urls.append(url)
+        return super().fetch(url)
+
+
+def catalog_pages(catalog, slug='rolex'):
+    pages = {}
+    for page in range(1, catalog.pages + 1):
+        url = f"{catalog.brand_url(slug)}?page={page}"
+        pages[url] = catalog.listing(slug, page)
+        for product_id in catalog.product_ids(slug, page):
+            watch = catalog.watch(slug, product_id)
+            pages[f"{BASE_URL}/{slug}/{watch['model_slug']}--id{product_id}.htm"] = catalog.detail(slug, product_id)
+    return pages
+
+
+def test_listing_page_parser():
+    catalog = FixtureCatalog(BASE_URL, pages=2, per_page=3)
+    first = parse_html(catalog.listing('rolex', 1), catalog.brand_url('rolex'))
+    assert [card['product_id'] for card in first.article_cards] == ['0', '1', '2']
+    assert first.article_cards[1]['price'] == catalog.watch('rolex', 1)['price']
+    assert {card['currency'] for card in first.article_cards} == {'GBP'}
+    assert first.article_links[0] == f"{BASE_URL}/rolex/submariner--id0.htm"
+    assert first.next_page_url == f"{BASE_URL}/rolex/index.htm?page=2"
+    assert first.result_count == 6
+    assert first.has_next_page(1)
+
+    last = parse_html(catalog.listing('rolex', 2), catalog.brand_url('rolex') + '?page=2')
+    assert last.next_page_url is None
+    assert not last.has_next_page(2)
+
+
+def test_detail_page_parser():
+    catalog = FixtureCatalog(BASE_URL)
+    # Even product IDs use the condition button layout, odd ones the .article-condition span
+    for product_id in (10, 11):
+        watch = catalog.watch('rolex', product_id)
+        detail = parse_html(catalog.detail('rolex', product_id))
+        assert detail.condition == watch['condition']
+        breadcrumb_list, product_data = detail.graph_nodes()
+        assert product_data['productID'] == str(product_id)
+        assert breadcrumb_list['itemListElement'][2]['item']['name'] == f"Rolex {watch['model']} watches"
+    assert parse_html(catalog.listing('rolex', 1)).graph_nodes() == (None, None)
+
+
+def test_find_graph_nodes():
+    breadcrumbs = {'@type': 'BreadcrumbList', 'itemListElement': []}
+    product = {'@type': 'Product', 'productID': '1'}
+    blocks = [
+        '{not json',
+        json.dumps([product]),
+        json.dumps({'@type': 'Organization'}),
+        json.dumps({'@graph': [breadcrumbs]}),
+        json.dumps({'@graph': [product, breadcrumbs]}),
+    ]
+    assert find_graph_nodes(blocks) == (breadcrumbs, product)
+    assert find_graph_nodes(blocks[:4]) == (None, None)
+    assert find_graph_nodes([]) == (None, None)
+
+
+def test_crawl(tmp_path):
+    conn = setup_database(str(tmp_path / 'watches.db'))
+    catalog = FixtureCatalog(BASE_URL, pages=2, per_page=3)
+    fetcher = FixtureFetcher(catalog_pages(catalog))
+    brands = {'Rolex': catalog.brand_url('rolex')}
+
+    assert crawl(conn, brands, fetcher, max_pages=None) == {'Rolex': (6, 0, 6)}
+    watch = catalog.watch('rolex', 4)
+    row = conn.execute("SELECT brand, model, ref, price, currency, condition, year FROM watches "
+                       "WHERE product_id = '4'").fetchone()
+    assert row == ('Rolex', f"Rolex {watch['model']}", watch['ref'], watch['price'], 'GBP', watch['condition'],
+                   int(watch['year']))
+    # The finished run's frontier is cleared
+    assert conn.execute("SELECT COUNT(*) FROM crawl_jobs").fetchone() == (0,)
+
+    # Nothing changed, so an incremental pass opens no detail pages
+    assert crawl(conn, brands, fetcher, max_pages=None, incremental=True) == {'Rolex': (0, 0, 0)}
+
+
+def test_blocked_fetch_falls_back(tmp_path):
+    conn = setup_database(str(tmp_path / 'watches.db'))
+    catalog = FixtureCatalog(BASE_URL, pages=1, per_page=2)
+    brands = {'Rolex': catalog.brand_url('rolex')}
+
+    blocked = BlockedFetcher(403)
+    assert crawl(conn, brands, blocked, FixtureFetcher(catalog_pages(catalog))) == {'Rolex': (2, 0, 2)}
+    assert len(blocked.urls) == 3
+
+    # Other errors aren't retried in the browser, and without a fallback a block fails the page
+    for fetcher, fallback_fetcher in ((BlockedFetcher(404), FixtureFetcher(catalog_pages(catalog))),
+                                      (BlockedFetcher(429), None)):
+        assert crawl(conn, brands, fetcher, fallback_fetcher, max_attempts=1) == {'Rolex': (0, 0, 0)}
+        assert fetcher.urls == [catalog.brand_url('rolex') + '?page=1']
+
+
+def test_incremental_compares_cards(tmp_path):
+    # The cards show euros while the listings are priced in pounds
+    conn = setup_database(str(tmp_path / 'watches.db'))
+    catalog = FixtureCatalog(BASE_URL, pages=1, per_page=3)
+    pages = catalog_pages(catalog)
+    listing_url = f"{catalog.brand_url('rolex')}?page=1"
+    pages[listing_url] = pages[listing_url].replace('&pound;', '€')
+    brands = {'Rolex': catalog.brand_url('rolex')}
+
+    assert crawl(conn, brands, FixtureFetcher(pages), incremental=True) == {'Rolex': (3, 0, 3)}
+    fetcher = RecordingFetcher(pages)
+    crawl(conn, brands, fetcher, incremental=True)
+    assert fetcher.urls == [listing_url]
+
+    watch = catalog.watch('rolex', 1)
+    pages[listing_url] = pages[listing_url].replace(f"€{watch['price_text']}", f"€{watch['price'] + 10:,}")
+    fetcher = RecordingFetcher(pages)
+    crawl(conn, brands, fetcher, incremental=True)
+    assert fetcher.urls == [listing_url, f"{BASE_URL}/rolex/{watch['model_slug']}--id1.htm"]
@@ -0,0 +1,37 @@
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from database import setup_database, upsert_watches, query_watches_page, WATCH_COLUMNS
+
+
+def read_pages(conn, limit, **options):
+    rows = []
+    while True:
+        after = None
+        if rows:
+            order_by = options.get('order_by')
+            after = (rows[-1][WATCH_COLUMNS.index(order_by)] if order_by else None, rows[-1][-1])
+        page = query_watches_page(conn, limit, after=after, **options)
+        rows.extend(page)
+        if len(page) < limit:
+            return rows
+
+
+def test_keyset_pages_match_sorted_query(tmp_path):
+    # Few distinct values and plenty of NULLs, so pages split ties and cross into the NULL range
+    conn = setup_database(str(tmp_path / 'watches.db'))
+    rng = random.Random(0)
+    upsert_watches(conn, [(str(product_id), rng.choice(['Rolex', 'Omega']), 'Model', rng.choice(['A1', 'B2', 'C3']),
+                           rng.choice([1000, 2000, 3000, None]), 'GBP', rng.choice(['New', 'Used']),
+                           rng.choice(['2020', '2021', None])) for product_id in range(150)])
+
+    for order_by in (None, 'price', 'year', 'ref', 'brand'):
+        for descending in (False, True):
+            direction = 'DESC' if descending else 'ASC'
+            order = f"{order_by} {direction}, rowid {direction}" if order_by else f"rowid {direction}"
+            expected = conn.execute(f"SELECT {', '.join(WATCH_COLUMNS)}, rowid FROM watches WHERE brand = 'Rolex' "
+                                    f"ORDER BY {order}").fetchall()
+            assert read_pages(conn, 7, order_by=order_by, descending=descending, brand='Rolex') == expected